@@ -0,0 +1,172 @@
+import os, io, hmac
+from contextlib import asynccontextmanager
+import anyio.to_thread
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Route
+import core
+import tracing
+from jobs import JobQueue
+from payload import parse_prometheus, coerce_bill, coerce_calculation, REQUIRED
+
+API_THREADS = int(os.environ.get("EBILLX_API_THREADS", 64))
+MAX_UPLOAD_BYTES = int(float(os.environ.get("EBILLX_API_MAX_UPLOAD_MB", 15)) * 1024 * 1024)
+API_TOKEN = os.environ.get("EBILLX_API_TOKEN", "")
+DOC_TYPES = {"pdf": "application/pdf", "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document"}
+
+def error(status, message):
+    return JSONResponse({"error": message}, status_code=status)
+
+class TokenAuth(BaseHTTPMiddleware):
+    async def dispatch(self, request, call_next):
+        if API_TOKEN and request.url.path not in ("/health",):
+            given = request.headers.get("authorization", "").removeprefix("Bearer ").strip()
+            if not hmac.compare_digest(given, API_TOKEN):
+                return error(401, "invalid or missing API token")
+        return await call_next(request)
+
+async def json_body(request):
+    try:
+        body = await request.json()
+    except ValueError:
+        return None
+    return body if isinstance(body, dict) else None
+
+async def health(request):
+    return JSONResponse({"status": "ok", "gemini": core.client is not None, "degraded": core.gemini_degraded()})
+
+async def metrics(request):
+    return PlainTextResponse(tracing.prometheus_text() + parse_prometheus(), media_type="text/plain; version=0.0.4")
+
+async def upload_form(request):
+    form = await request.form(max_files=1)
+    upload = form.get("file")
+    if upload is None or not hasattr(upload, "read"):
+        return None, error(400, "multipart field 'file' (bill image) is required")
+    data = await upload.read()
+    if len(data) > MAX_UPLOAD_BYTES:
+        return None, error(413, f"image larger than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+    mode = form.get("mode") or None
+    if mode is not None and mode not in core.ANALYSIS_MODES:
+        return None, error(400, "mode must be one of " + ", ".join(core.ANALYSIS_MODES))
+    return (data, str(form.get("extra_context") or ""), mode), None
+
+async def analyze(request):
+    args, err = await upload_form(request)
+    if err is not None:
+        return err
+    data, extra_context, mode = args
+    # Core calls are blocking; running them in the threadpool keeps the event loop free for other requests
+    res = await run_in_threadpool(core.analyze_bill, io.BytesIO(data), extra_context, mode)
+    status = 200 if res["error"] is None else (422 if res["extracted"] is not None else 502)
+    return JSONResponse(res, status_code=status)
+
+async def submit_job(request):
+    args, err = await upload_form(request)
+    if err is not None:
+        return err
+    data, extra_context, mode = args
+    job_id = await run_in_threadpool(request.app.state.jobs.submit, data, extra_context, mode, core.job_input_key(data, extra_context, mode))
+    return JSONResponse({"id": job_id, "status_url": f"/v1/jobs/{job_id}"}, status_code=202)
+
+async def job_status(request):
+    job = await run_in_threadpool(request.app.state.jobs.get, request.path_params["job_id"])
+    if job is None:
+        return error(404, "unknown job")
+    return JSONResponse(job)
+
+_SHAPE_PROBLEMS = ("expected an object", "expected a list", REQUIRED)
+
+def coerced(body, key, coerce):
+    # Client JSON goes through the same schema as model output; a wrong shape is the client's error, not a 500
+    value, problems = coerce(body.get(key))
+    shape = [p for p in problems if p.endswith(_SHAPE_PROBLEMS)]
+    if value is None or shape:
+        return None, error(400, f"'{key}' is not a valid object: " + ("; ".join(shape or problems)))
+    return value, None
+
+async def calculate(request):
+    body = await json_body(request)
+    if not body or not isinstance(body.get("extracted"), dict):
+        return error(400, "JSON body with an 'extracted' object is required")
+    extracted, err = coerced(body, "extracted", coerce_bill)
+    if err:
+        return err
+    calc_res, calc_err, source = await run_in_threadpool(core.calculate, extracted, str(body.get("extra_context") or ""))
+    if calc_res is None:
+        return error(502, str(calc_err))
+    return JSONResponse({"calculation": calc_res, "calc_source": source})
+
+async def mistakes(request):
+    body = await json_body(request)
+    if not body or not isinstance(body.get("extracted"), dict) or not isinstance(body.get("calculation"), dict):
+        return error(400, "JSON body with 'extracted' and 'calculation' objects is required")
+    extracted, err = coerced(body, "extracted", coerce_bill)
+    if err:
+        return err
+    calc_res, err = coerced(body, "calculation", coerce_calculation)
+    if err:
+        return err
+    return JSONResponse({"mistakes": core.detect_mistakes(extracted, calc_res)})
+
+async def letter(request):
+    body = await json_body(request)
+    if not body or not isinstance(body.get("extracted"), dict):
+        return error(400, "JSON body with an 'extracted' object is required")
+    args = (body["extracted"], body.get("calculation") or {}, body.get("mistakes") or [], str(body.get("extra_context") or ""),
+            body.get("officer") or "EXECUTIVE ENGINEER", body.get("lang") or "English", body.get("mobile") or "", body.get("date") or "")
+    text, source = None, "local"
+    if body.get("use_gemini", True) and body.get("template", core.LETTER_TEMPLATES):
+        bill, calc, selected, extra, officer, lang, mobile, app_date = args
+        text, _ = await run_in_threadpool(core.template_letter, bill, selected, extra, officer, lang, mobile, app_date)
+        source = "template"
+    elif body.get("use_gemini", True) and core.client is not None and not core.gemini_degraded():
+        text, _ = await run_in_threadpool(core.call_gemini_letter, *args)
+        source = "gemini"
+    if text is None:
+        bill, calc, selected, extra, officer, lang, mobile, app_date = args
+        text = core.generate_local_simple_letter(bill, selected, officer, lang, mobile, app_date, extra)
+        source = "local"
+    return JSONResponse({"letter": text, "source": source})
+
+async def document(request):
+    fmt = request.path_params["fmt"]
+    if fmt not in DOC_TYPES:
+        return error(404, "format must be pdf or docx")
+    body = await json_body(request)
+    if not body or not isinstance(body.get("text"), str):
+        return error(400, "JSON body with a 'text' string is required")
+    data = await run_in_threadpool(core.render_document, body["text"], fmt)
+    name = str(body.get("file_name") or f"Complaint.{fmt}").replace('"', "")
+    return Response(data, media_type=DOC_TYPES[fmt], headers={"Content-Disposition": f'attachment; filename="{name}"'})
+
+routes = [
+    Route("/health", health),
+    Route("/metrics", metrics),
+    Route("/v1/analyze", analyze, methods=["POST"]),
+    Route("/v1/jobs", submit_job, methods=["POST"]),
+    Route("/v1/jobs/{job_id}", job_status),
+    Route("/v1/calculate", calculate, methods=["POST"]),
+    Route("/v1/mistakes", mistakes, methods=["POST"]),
+    Route("/v1/letter", letter, methods=["POST"]),
+    Route("/v1/document/{fmt}", document, methods=["POST"]),
+]
+
+@asynccontextmanager
+async def lifespan(app):
+    # Each in-flight analysis holds a worker thread while it waits on Gemini; the default pool (40) caps concurrency
+    anyio.to_thread.current_default_thread_limiter().total_tokens = API_THREADS
+    app.state.jobs = JobQueue(core.analyze_bytes).start()
+    yield
+    app.state.jobs.stop()
+    tracing.flush()
+
+app = Starlette(routes=routes, middleware=[Middleware(TokenAuth)], lifespan=lifespan)
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run("api:app", host=os.environ.get("HOST", "0.0.0.0"), port=int(os.environ.get("PORT", 8000)),
+                workers=int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1)))
@@ -1,49 +1,119 @@
 import os
 os.environ["STREAMLIT_SERVER_HEADLESS"] = "true"
+import time
+_run_start = time.perf_counter()
 import streamlit as st
-import io, json, re
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+import io, csv, json, threading
 from datetime import date
 from PIL import Image
-from docx import Document
-from fpdf import FPDF
-import requests
-from streamlit_lottie import st_lottie
-try:
-    from google import genai
-except Exception:
-    genai = None
+from jobs import JobQueue, FINAL
+from session_store import Bill, Calculation, Mistake, MissingBlobError, unstash, account, memory_stats, forget_idle
+from batch import iter_inputs, run_batch, to_row, CSV_FIELDS
+from letter_export import export_letters, iter_letters
+from core import (client, extract_cache, gemini_degraded, gemini_stats, analysis_stats, ANALYSIS_MODES, stream_gemini_letter,
+                  generate_local_simple_letter, render_document, analyze_bytes, blob_store, job_input_key, template_letter, letter_cache_stats, LETTER_TEMPLATES)
+from payload import parse_number, parse_stats, parse_prometheus
+import tracing
+from tracing import span
 
 st.set_page_config(page_title="EBillX - Electricity Bill Analyzer", page_icon="⚡", layout="wide", initial_sidebar_state="expanded")
 
-def get_client():
-    key = None
-    if "GEMINI_API_KEY" in os.environ:
-        key = os.environ["GEMINI_API_KEY"]
-    else:
-        try:
-            key = st.secrets["GEMINI_API_KEY"]
-        except Exception:
-            key = None
-    if not key or genai is None:
-        return None
-    try:
-        return genai.Client(api_key=key)
-    except Exception:
-        return None
+LOTTIE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "bolt_lottie.json")
+LOTTIE_URL = os.environ.get("EBILLX_LOTTIE_URL", "")
+API_URL = os.environ.get("EBILLX_API_URL", "").rstrip("/")
 
-client = get_client()
+def analyze_via_api(image_file, extra_context, mode):
+    # Thin-client mode: the API service runs the pipeline, this process only renders
+    import requests
+    headers = {"Authorization": f"Bearer {os.environ['EBILLX_API_TOKEN']}"} if os.environ.get("EBILLX_API_TOKEN") else {}
+    try:
+        r = requests.post(f"{API_URL}/v1/analyze", files={"file": ("bill", image_file.getvalue())},
+                          data={"extra_context": extra_context or "", "mode": mode or ""}, headers=headers, timeout=180)
+        res = r.json()
+    except Exception as e:
+        return {"extracted": None, "calculation": None, "calc_source": None, "mistakes": [], "error": f"API request failed: {e}", "mode": mode}
+    if "extracted" not in res:
+        return {"extracted": None, "calculation": None, "calc_source": None, "mistakes": [], "error": res.get("error") or f"API error {r.status_code}", "mode": mode}
+    return res
+
+@st.cache_resource
+def job_queue():
+    # One worker pool per server process, shared by all sessions
+    handler = (lambda data, extra_context, mode: analyze_via_api(io.BytesIO(data), extra_context, mode)) if API_URL else analyze_bytes
+    return JobQueue(handler).start()
+
+def load_record(rec):
+    # Raw text and other long fields live in the blob store; if they are gone, say so instead of using empty data
+    try:
+        return rec.to_dict(blob_store) if rec is not None else None
+    except MissingBlobError:
+        st.error("सत्र का डेटा समाप्त हो गया, कृपया बिल फिर से विश्लेषण करें / Session data expired, please analyze the bill again")
+        st.stop()
+
+def apply_result(res):
+    messages = []
+    if res["extracted"] is None:
+        messages.append(("error", res["error"]))
+    else:
+        # Typed, slotted records; raw bill text and other long strings stay on disk behind a handle
+        st.session_state.extracted = Bill.from_dict(res["extracted"], blob_store)
+        messages.append(("success", "Extraction successful"))
+        if res["calculation"] is None:
+            messages.append(("error", res["error"]))
+            st.session_state.calculation = None
+        else:
+            st.session_state.calculation = Calculation.from_dict(res["calculation"], blob_store)
+            messages.append(("success", f"Calculation completed by {res['calc_source']} ({res['mode']})"))
+            st.session_state.analysis_mistakes = [Mistake.from_dict(m) for m in res["mistakes"]]
+    st.session_state.analysis_messages = messages
+
+@st.fragment(run_every=1.0)
+def job_status():
+    # Only this fragment reruns while the job is pending; the full script reruns once, when the result is in
+    job = job_queue().get(st.session_state.job_id)
+    if job is None:
+        st.session_state.job_id = None
+        st.query_params.pop("job", None)
+        st.rerun()
+    if job["status"] not in FINAL:
+        waited = round(time.time() - job["created"])
+        if job["status"] == "queued":
+            st.info(f"⏳ Queued ({job['queue_position']} ahead) · {waited}s")
+        else:
+            st.info(f"⚙️ Analyzing... {waited}s")
+        return
+    st.session_state.job_id = None
+    if job["result"] is not None:
+        apply_result(job["result"])
+    else:
+        st.session_state.analysis_messages = [("error", job["error"] or "Analysis failed")]
+    st.rerun()
 
 @st.cache_data
-def load_lottie(url: str):
+def load_local_lottie(path):
     try:
-        r = requests.get(url, timeout=8)
-        if r.status_code == 200:
-            return r.json()
-    except:
-        pass
-    return None
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return None
 
-LOTTIE = load_lottie("https://assets10.lottiefiles.com/packages/lf20_jtbfg2nb.json")
+@st.cache_resource
+def remote_lottie():
+    # Optional remote animation, fetched off the script thread; the bundled one is shown until it arrives
+    holder = {"data": None}
+    def fetch():
+        try:
+            import requests
+            with span("app.load_lottie_remote"):
+                r = requests.get(LOTTIE_URL, timeout=8)
+            if r.status_code == 200:
+                holder["data"] = r.json()
+        except Exception:
+            pass
+    if LOTTIE_URL:
+        threading.Thread(target=fetch, daemon=True).start()
+    return holder
 
 st.markdown("""
 <style>
@@ -61,186 +131,6 @@ td { background:#08151b; color:#c9d1d9; }
 </style>
 """, unsafe_allow_html=True)
 
-def safe_clean_json(text):
-    if not text:
-        return None
-    s = text.strip()
-    s = re.sub(r"^```(?:json)?", "", s, flags=re.IGNORECASE).strip()
-    s = re.sub(r"```$", "", s).strip()
-    s = re.sub(r'[\u200b-\u200f\u202a-\u202e]', '', s)
-    try:
-        return json.loads(s)
-    except:
-        m = re.search(r"\{.*\}", s, flags=re.DOTALL)
-        if m:
-            try:
-                return json.loads(m.group(0))
-            except:
-                pass
-        m2 = re.search(r"\[.*\]", s, flags=re.DOTALL)
-        if m2:
-            try:
-                return json.loads(m2.group(0))
-            except:
-                pass
-    return None
-
-def call_gemini_extract(image_file, extra_context=""):
-    if client is None:
-        return None, "Gemini client not configured"
-    try:
-        img = Image.open(image_file)
-        prompt = (
-            "You are an expert extractor. From the provided electricity bill image, return a JSON only with keys: "
-            "Consumer_ID, Consumer_Name, Sanctioned_Load_kW, Units_Consumed_kWh, Billing_Date, Total_Amount_Payable_INR, Discom_Name, Division, Tariff_Category, Raw_Bill_Text. "
-            "If any value is missing, set it to 'N/A'. Provide values as simple strings or numbers. Context: " + extra_context
-        )
-        resp = client.models.generate_content(model="gemini-2.5-flash", contents=[prompt, img])
-        text = getattr(resp, "text", None) or str(resp)
-        parsed = safe_clean_json(text)
-        if parsed is None:
-            return None, "Gemini returned non-JSON or unparsable response"
-        return parsed, None
-    except Exception as e:
-        return None, str(e)
-
-def call_gemini_calculate_and_explain(bill_payload, extra_context=""):
-    if client is None:
-        return None, "Gemini client not configured"
-    try:
-        prompt = (
-            "You are a billing expert. Given the extracted bill data and raw text, identify the applicable discom, division, tariff category, fixed charge, slab structure (range and rate), duty percentage and any surcharge. "
-            "Then calculate slab-wise energy charges, fixed charges and duty and present a full breakdown and final total. Finally compare your calculated total with the provided Total_Amount_Payable_INR and output a JSON with keys: discom, division, tariff_category, fixed_per_kw, slabs (list of {range, rate}), duty, calculation {fixed, energy_details, energy_total, duty, total}, bill_correct (true/false), difference. Use the bill data below and extra context: "
-            + json.dumps(bill_payload, ensure_ascii=False)
-        )
-        resp = client.models.generate_content(model="gemini-2.5-flash", contents=[prompt])
-        text = getattr(resp, "text", None) or str(resp)
-        parsed = safe_clean_json(text)
-        if parsed is None:
-            return None, "Gemini calculation returned non-JSON or unparsable response"
-        return parsed, None
-    except Exception as e:
-        return None, str(e)
-
-def call_gemini_letter(bill, calculation_json, selected_mistakes, extra_context, officer, lang, mobile, app_date):
-    if client is None:
-        return None, "Gemini client not configured"
-    try:
-        prompt = (
-            f"You are a formal government letter writer. Using the bill data, calculation results and user context, write a formal complaint letter addressed to {officer}. "
-            f"Include the identified mistakes and request action. Language: {lang}. Mobile: {mobile}. Date: {app_date}. "
-            "Bill data:\n" + json.dumps(bill, ensure_ascii=False) + "\nCalculation:\n" + json.dumps(calculation_json, ensure_ascii=False) + "\nMistakes:\n" + json.dumps(selected_mistakes, ensure_ascii=False) + "\nUser context:\n" + extra_context + "\nOutput only the final letter text."
-        )
-        resp = client.models.generate_content(model="gemini-2.5-flash", contents=[prompt])
-        text = getattr(resp, "text", None) or str(resp)
-        clean = re.sub(r'[\u200b-\u200f\u202a-\u202e]', '', text).strip()
-        return clean, None
-    except Exception as e:
-        return None, str(e)
-
-def generate_local_simple_letter(bill, mistakes, officer, lang, mobile, app_date, extra_context):
-    points = "\n".join(["- " + (m.get("Description_Hindi") or m.get("description") or "") for m in mistakes]) if mistakes else ""
-    context_para = extra_context if extra_context and extra_context.strip() != "" else ""
-    if lang == "हिंदी":
-        letter = f"""सेवा में,
-{officer}
-{bill.get('Discom_Name','')}
-दिनांक: {app_date}
-
-विषय: बिजली बिल में विसंगति के संबंध में शिकायत — उपभोक्ता संख्या {bill.get('Consumer_ID','N/A')}
-
-मान्यवर,
-
-मैं, {bill.get('Consumer_Name','N/A')} (उपभोक्ता संख्या: {bill.get('Consumer_ID','N/A')}), सूचित करता/करती हूँ कि मेरे बिल में निम्नलिखित विसंगतियाँ पाई गईं:
-{points}
-
-{context_para}
-
-कृपया बिल की जाँच कर आवश्यक सुधार करें। कृपया कार्रवाई की सूचना मेरे मोबाइल {mobile} पर उपलब्ध कराएँ।
-
-धन्यवाद,
-{bill.get('Consumer_Name','N/A')}
-"""
-    else:
-        letter = f"""To,
-{officer}
-{bill.get('Discom_Name','')}
-Date: {app_date}
-
-Subject: Complaint regarding discrepancy in electricity bill — Consumer ID {bill.get('Consumer_ID','N/A')}
-
-Respected Sir/Madam,
-
-I, {bill.get('Consumer_Name','N/A')} (Consumer ID: {bill.get('Consumer_ID','N/A')}), wish to inform you of the following discrepancies in my bill:
-{points}
-
-{context_para}
-
-Kindly re-check the bill and make necessary corrections. Please notify me at mobile {mobile}.
-
-Thank you,
-{bill.get('Consumer_Name','N/A')}
-"""
-    return letter
-
-
-def create_pdf_buffer(text):
-    text = re.sub(r'[\u200b-\u200f\u202a-\u202e]', '', text)
-
-    pdf = FPDF(format='A4')
-    pdf.add_page()
-    pdf.set_left_margin(12)
-    pdf.set_right_margin(12)
-
-    try:
-        pdf.add_font("NotoSans", "", "NotoSans-Regular.ttf", uni=True)
-        pdf.set_font("NotoSans", size=11)
-    except:
-        pdf.set_font("Arial", size=11)
-
-    max_width = pdf.w - 24
-
-    for para in text.split("\n"):
-        line = para.strip()
-        if line == "":
-            pdf.ln(6)
-            continue
-
-        while len(line) > 0:
-            try:
-                pdf.multi_cell(max_width, 6, line)
-                break
-            except Exception:
-                if len(line) <= 1:
-                    break
-                split_at = max(1, int(len(line) * 0.8))
-                part = line[:split_at]
-                try:
-                    pdf.multi_cell(max_width, 6, part)
-                    line = line[split_at:].lstrip()
-                except Exception:
-                    line = line[1:]
-
-    pdf_bytes = bytes(pdf.output(dest='S'))
-    buf = io.BytesIO(pdf_bytes)
-    buf.seek(0)
-    return buf
-
-def create_docx_buffer(text):
-    doc = Document()
-    for line in text.split("\n"):
-        doc.add_paragraph(line)
-    buf = io.BytesIO()
-    doc.save(buf)
-    buf.seek(0)
-    return buf
-
-def pretty_json(v):
-    try:
-        return json.dumps(v, ensure_ascii=False, indent=2)
-    except:
-        return str(v)
-
 st.title("⚡ EBillX — Electricity Bill Analyzer")
 ui_lang = st.radio("App भाषा / App Language", ["हिंदी", "English"], horizontal=True)
 
@@ -251,13 +141,27 @@ with col1:
         img = Image.open(image_path)
         st.image(img, use_column_width=True)
     except:
-        if LOTTIE:
-            st_lottie(LOTTIE, height=220)
+        with span("app.load_lottie"):
+            anim = remote_lottie()["data"] or load_local_lottie(LOTTIE_FILE)
+        if anim:
+            from streamlit_lottie import st_lottie
+            st_lottie(anim, height=220)
     st.write("")
-    if client:
+    if client and gemini_degraded():
+        st.warning("Gemini is degraded — using local fallbacks until it recovers")
+    elif client:
         st.success("Gemini configured")
     else:
         st.warning("Gemini not configured. Set GEMINI_API_KEY in env or st.secrets")
+    if extract_cache is not None:
+        cs = extract_cache.stats()
+        st.caption(f"Extract cache: {cs['hits']} hits / {cs['misses']} misses · {cs['entries']} entries")
+    ls = letter_cache_stats()
+    if ls is not None:
+        st.caption(f"Letter cache: {ls['hits']} hits / {ls['misses']} misses · {ls['entries']} entries")
+    for m, a in analysis_stats().items():
+        if a["runs"]:
+            st.caption(f"{m}: {a['runs']} runs · mean {a['mean_latency_s']}s · {a['parse_failures']} parse failures / {a['failures']} failures")
 
 with col2:
     if ui_lang == "हिंदी":
@@ -281,50 +185,27 @@ if 'analysis_mistakes' not in st.session_state:
     st.session_state.analysis_mistakes = None
 if 'letter_text' not in st.session_state:
     st.session_state.letter_text = None
+if 'job_id' not in st.session_state:
+    # A refresh or reconnect starts a new session; the job ID in the URL brings back the running or finished analysis
+    st.session_state.job_id = st.query_params.get("job")
 
 if uploaded_file is not None:
+    modes = list(ANALYSIS_MODES)
+    default_mode = os.environ.get("EBILLX_ANALYSIS_MODE", "two-call")
+    analysis_mode = st.selectbox("Analysis mode", modes, index=modes.index(default_mode) if default_mode in modes else 0,
+                                 help="two-call: extract then calculate · fused: one structured-output call · ab: pick one at random per analysis")
     if st.button("📥 Extract & Analyze (Gemini)"):
-        with st.spinner("Processing..."):
-            extracted, err = call_gemini_extract(uploaded_file, extra_context)
-            if extracted is None:
-                st.error("Extraction failed: " + str(err))
-            else:
-                st.session_state.extracted = extracted
-                st.success("Extraction successful")
-                calc_res, calc_err = call_gemini_calculate_and_explain(extracted, extra_context)
-                if calc_res is None:
-                    st.error("Calculation by Gemini failed: " + str(calc_err))
-                    st.session_state.calculation = None
-                else:
-                    st.session_state.calculation = calc_res
-                    st.success("Calculation completed by Gemini")
-                    mistakes = []
-                    provided = None
-                    try:
-                        provided = float(extracted.get("Total_Amount_Payable_INR")) if extracted.get("Total_Amount_Payable_INR") not in (None, "", "N/A") else None
-                    except:
-                        provided = None
-                    calc_total = None
-                    try:
-                        calc_total = float(calc_res.get("calculation", {}).get("total"))
-                    except:
-                        calc_total = None
-                    if calc_total is not None and provided is not None:
-                        diff = abs(calc_total - provided)
-                        pct = (diff / provided * 100) if provided else 0
-                        if pct > 3:
-                            mistakes.append({"Mistake_Code":"CALC_ERR", "Description_Hindi": f"बिल गणना में अंतर: अपेक्षित ₹{calc_total} जबकि बिल में ₹{provided}. अंतर {round(pct,2)}%."})
-                    if extracted.get("Sanctioned_Load_kW") in (None, "", "N/A"):
-                        mistakes.append({"Mistake_Code":"MISSING_DATA", "Description_Hindi":"Sanctioned Load गायब है।"})
-                    try:
-                        sload = float(extracted.get("Sanctioned_Load_kW")) if extracted.get("Sanctioned_Load_kW") not in (None, "", "N/A") else None
-                        units = float(extracted.get("Units_Consumed_kWh")) if extracted.get("Units_Consumed_kWh") not in (None, "", "N/A") else None
-                        if sload and units:
-                            if units / sload > 200:
-                                mistakes.append({"Mistake_Code":"HIGH_USE", "Description_Hindi":f"प्रति kW {round(units/sload,1)} यूनिट — असामान्य खपत।"})
-                    except:
-                        pass
-                    st.session_state.analysis_mistakes = mistakes
+        data = uploaded_file.getvalue()
+        job_id = job_queue().submit(data, extra_context, analysis_mode, job_input_key(data, extra_context, analysis_mode))
+        for k in ['extracted', 'calculation', 'analysis_mistakes', 'selected_mistakes', 'letter_text', 'analysis_messages']:
+            st.session_state.pop(k, None)
+        st.session_state.job_id = job_id
+        st.query_params["job"] = job_id
+
+if st.session_state.get("job_id"):
+    job_status()
+for kind, msg in st.session_state.get("analysis_messages", []):
+    getattr(st, kind)(msg)
 
 if st.session_state.extracted:
     st.markdown("---")
@@ -340,6 +221,7 @@ if st.session_state.extracted:
         "Discom": ex.get('Discom_Name','N/A'),
         "Division": ex.get('Division','N/A'),
         "Tariff": ex.get('Tariff_Category','N/A'),
+        "Reading Type": ex.get('Reading_Type','N/A'),
         "Sanctioned Load (kW)": ex.get('Sanctioned_Load_kW','N/A'),
         "Units Consumed (kWh)": ex.get('Units_Consumed_kWh','N/A'),
         "Bill Amount (₹)": ex.get('Total_Amount_Payable_INR','N/A')
@@ -353,35 +235,23 @@ if st.session_state.calculation:
     else:
         st.subheader("Slab-wise Calculation")
     calc = st.session_state.calculation
-    # Build table rows from calc['calculation']['energy_details']
-    energy = calc.get('calculation', {}).get('energy_details', [])
-    rows = []
-    for e in energy:
-        slab_name = e.get('slab') or e.get('range') or ''
-        units = e.get('units') or e.get('units_billed') or e.get('units_billed', 0)
-        rate = e.get('rate') or e.get('rate', 0)
-        amount = e.get('amount') or e.get('amount', 0)
-        rows.append({"Slab": slab_name, "Units": units, "Rate (₹/unit)": rate, "Amount (₹)": amount})
+    rows = [{"Slab": e.slab, "Units": e.units, "Rate (₹/unit)": e.rate, "Amount (₹)": e.amount} for e in calc.energy]
     # display table
     st.table(rows)
     # summary
-    summ = calc.get('calculation', {})
-    fixed = summ.get('fixed', 0)
-    energy_total = summ.get('energy_total', 0)
-    duty = summ.get('duty', 0)
-    total = summ.get('total', 0)
-    provided = None
-    try:
-        provided = float(st.session_state.extracted.get('Total_Amount_Payable_INR'))
-    except:
-        provided = None
+    fixed = calc.fixed
+    energy_total = calc.energy_total
+    duty = calc.duty
+    total = calc.total
+    provided = parse_number(st.session_state.extracted.get('Total_Amount_Payable_INR'))
     st.markdown("**Summary**")
     st.write(f"Fixed Charge: ₹{fixed}")
     st.write(f"Energy Total: ₹{energy_total}")
     st.write(f"Duty: ₹{duty}")
     st.write(f"Calculated Total: ₹{total}")
-    if provided is not None:
-        diff = round(abs(total - provided),2)
+    calc_total = parse_number(total)
+    if provided is not None and calc_total is not None:
+        diff = round(abs(calc_total - provided),2)
         st.write(f"Bill Total (from bill): ₹{provided}")
         st.write(f"Difference: ₹{diff}")
         if diff <=  (0.03 * provided):
@@ -397,7 +267,7 @@ if st.session_state.analysis_mistakes is not None:
         st.subheader("Potential Mistakes")
     if st.session_state.analysis_mistakes:
         for i, m in enumerate(st.session_state.analysis_mistakes):
-            checked = st.checkbox(f"[{m.get('Mistake_Code')}] {m.get('Description_Hindi')}", value=True, key=f"mist_{i}")
+            checked = st.checkbox(f"[{m.code}] {m.description}", value=True, key=f"mist_{i}")
         selected = [m for i,m in enumerate(st.session_state.analysis_mistakes) if st.session_state.get(f"mist_{i}", True)]
         st.session_state.selected_mistakes = selected
     else:
@@ -413,21 +283,46 @@ if st.session_state.calculation and st.session_state.extracted:
     else:
         st.subheader("Generate Application Letter")
     use_gemini_letter = st.checkbox("Gemini से पत्र परिष्कृत करें (यदि उपलब्ध)", value=True)
+    use_template = st.checkbox("टेम्पलेट मोड / Template mode", value=LETTER_TEMPLATES,
+                               help="एक ही प्रकार की शिकायतों के लिए एक बार बना पत्र-ढाँचा दोबारा उपयोग करें · Reuse one generated letter body per complaint type and fill in your details locally")
     if ui_lang == "हिंदी":
         extra_for_letter = st.text_area("पत्र के लिए अतिरिक्त संदर्भ (optional)", placeholder="उदाहरण: कई महीनों से गलत आ रहा है")
     else:
         extra_for_letter = st.text_area("Additional context for letter (optional)")
     if st.button("📝 पत्र बनाएं / Generate Letter"):
-        with st.spinner("Generating letter..."):
-            selected = st.session_state.get("selected_mistakes", [])
-            if use_gemini_letter and client is not None:
-                letter, err = call_gemini_letter(st.session_state.extracted, st.session_state.calculation, selected, extra_for_letter, officer, "Hindi" if ui_lang=="हिंदी" else "English", mobile, app_date.isoformat())
-                if letter is None:
-                    letter = generate_local_simple_letter(st.session_state.extracted, selected, officer, "Hindi" if ui_lang=="हिंदी" else "English", mobile, app_date.isoformat(), extra_for_letter)
-                st.session_state.letter_text = letter
-            else:
-                letter = generate_local_simple_letter(st.session_state.extracted, selected, officer, "Hindi" if ui_lang=="हिंदी" else "English", mobile, app_date.isoformat(), extra_for_letter)
-                st.session_state.letter_text = letter
+        selected = [m.to_dict() for m in st.session_state.get("selected_mistakes", [])]
+        bill = load_record(st.session_state.extracted)
+        letter_lang = "Hindi" if ui_lang=="हिंदी" else "English"
+        letter = None
+        st.session_state.letter_metrics = None
+        if use_gemini_letter and use_template:
+            with st.spinner("Generating letter..."):
+                letter, err = template_letter(bill, selected, extra_for_letter, officer, letter_lang, mobile, app_date.isoformat())
+            if letter is None:
+                st.warning("Letter template unavailable, using simple letter: " + str(err))
+        elif use_gemini_letter and client is not None and not gemini_degraded():
+            preview = st.empty()
+            metrics = {}
+            parts = []
+            try:
+                with st.spinner("Generating letter..."):
+                    chunks = stream_gemini_letter(bill, load_record(st.session_state.calculation), selected, extra_for_letter, officer, letter_lang, mobile, app_date.isoformat(), metrics)
+                    first = next(chunks, None)
+                if first is not None:
+                    parts.append(first)
+                    preview.text("".join(parts))
+                    for chunk in chunks:
+                        parts.append(chunk)
+                        preview.text("".join(parts))
+                letter = "".join(parts).strip() or None
+                st.session_state.letter_metrics = metrics
+            except Exception as e:
+                st.warning("Gemini letter stream failed, using simple letter: " + str(e))
+                letter = None
+            preview.empty()
+        if letter is None:
+            letter = generate_local_simple_letter(bill, selected, officer, letter_lang, mobile, app_date.isoformat(), extra_for_letter)
+        st.session_state.letter_text = letter
         st.success("Letter ready")
 
 if st.session_state.letter_text:
@@ -437,19 +332,118 @@ if st.session_state.letter_text:
     else:
         st.subheader("Generated Letter")
     st.text_area("Letter / पत्र", st.session_state.letter_text, height=360)
-    pdf_buf = create_pdf_buffer(st.session_state.letter_text)
-    docx_buf = create_docx_buffer(st.session_state.letter_text)
+    lm = st.session_state.get("letter_metrics")
+    if lm and lm.get("cached"):
+        st.caption("Served from letter cache")
+    elif lm and lm.get("total_s") is not None:
+        st.caption(f"First text in {lm['ttfb_s']}s · complete in {lm['total_s']}s")
+    letter_for_download = st.session_state.letter_text
     colp, cold, colc = st.columns([1,1,1])
-    colp.download_button("PDF डाउनलोड / Download PDF", pdf_buf, file_name=f"Complaint_{st.session_state.extracted.get('Consumer_ID','N-A')}.pdf", mime="application/pdf")
-    cold.download_button("DOCX डाउनलोड / Download DOCX", docx_buf, file_name=f"Complaint_{st.session_state.extracted.get('Consumer_ID','N-A')}.docx", mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document")
+    colp.download_button("PDF डाउनलोड / Download PDF", lambda: render_document(letter_for_download, "pdf"), file_name=f"Complaint_{st.session_state.extracted.get('Consumer_ID','N-A')}.pdf", mime="application/pdf", on_click="ignore")
+    cold.download_button("DOCX डाउनलोड / Download DOCX", lambda: render_document(letter_for_download, "docx"), file_name=f"Complaint_{st.session_state.extracted.get('Consumer_ID','N-A')}.docx", mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document", on_click="ignore")
     if colc.button("Start Over / फिर से शुरू करें"):
-        for k in ['extracted','calculation','analysis_mistakes','selected_mistakes','letter_text']:
+        for k in ['extracted','calculation','analysis_mistakes','selected_mistakes','letter_text','analysis_messages']:
             if k in st.session_state:
                 del st.session_state[k]
-        st.experimental_rerun()
+        st.query_params.pop("job", None)
+        st.rerun()
+
+st.markdown("---")
+with st.expander("📦 Batch mode / बल्क विश्लेषण"):
+    batch_files = st.file_uploader("Upload many bills or a ZIP / कई बिल या ZIP अपलोड करें", type=["jpg","jpeg","png","zip"], accept_multiple_files=True, key="batch_files")
+    batch_concurrency = st.slider("Concurrency", 1, 16, int(os.environ.get("EBILLX_BATCH_CONCURRENCY", 4)))
+    if batch_files and st.button("▶️ Run batch"):
+        items = list(iter_inputs([(f.name, f.getvalue()) for f in batch_files]))
+        progress = st.progress(0.0, text=f"0 / {len(items)}")
+        table = st.empty()
+        results = []
+        # Streamlit elements can only be updated from the script thread, so the pool runs in a helper thread
+        worker = threading.Thread(target=run_batch, args=(items, batch_concurrency, extra_context, results.append), daemon=True)
+        worker.start()
+        while True:
+            worker.join(timeout=0.5)
+            done = list(results)
+            progress.progress(len(done) / max(1, len(items)), text=f"{len(done)} / {len(items)}")
+            table.dataframe([to_row(r) for r in done], width="stretch")
+            if not worker.is_alive():
+                break
+        # Only a handle to the JSONL on disk is kept in the session; downloads are built on click
+        jsonl = "\n".join(json.dumps(r, ensure_ascii=False, default=str) for r in results)
+        st.session_state.batch_results = "blob:" + blob_store.put(jsonl) if blob_store is not None else jsonl
+    if (st.session_state.get("batch_results") or "").startswith("blob:") and not blob_store.exists(st.session_state.batch_results[5:]):
+        st.warning("बैच परिणाम समाप्त हो गए, कृपया फिर से चलाएँ / Batch results expired, please run the batch again")
+        st.session_state.batch_results = None
+        st.session_state.letter_export = None
+    if st.session_state.get("letter_export") and not blob_store.exists(st.session_state.letter_export[0][5:]):
+        st.warning("पत्र निर्यात फ़ाइल समाप्त हो गई, कृपया फिर से बनाएं / Letter export expired, please export again")
+        st.session_state.letter_export = None
+    if st.session_state.get("batch_results"):
+        ref = st.session_state.batch_results
+        key = ref[5:] if ref.startswith("blob:") else ""
+
+        def batch_jsonl(ref=ref):
+            return unstash(ref, blob_store)
+
+        def batch_csv():
+            csv_buf = io.StringIO()
+            w = csv.DictWriter(csv_buf, fieldnames=CSV_FIELDS, extrasaction="ignore")
+            w.writeheader()
+            for line in batch_jsonl().splitlines():
+                w.writerow(to_row(json.loads(line)))
+            return csv_buf.getvalue()
+
+        b1, b2 = st.columns(2)
+        b1.download_button("CSV डाउनलोड / Download CSV", batch_csv, file_name="ebillx_batch.csv", mime="text/csv", on_click="ignore")
+        b2.download_button("JSONL डाउनलोड / Download JSONL", batch_jsonl, file_name="ebillx_batch.jsonl", mime="application/json", on_click="ignore")
+
+        e1, e2 = st.columns(2)
+        export_fmt = e1.selectbox("Letters export / पत्र निर्यात", ["zip", "pdf", "docx"],
+                                  format_func={"zip": "ZIP (one PDF per consumer)", "pdf": "Merged PDF", "docx": "DOCX (page per letter)"}.get)
+        if e2.button("🗂️ Export letters / सभी पत्र बनाएं") and blob_store is not None:
+            lines = batch_jsonl().splitlines()
+            records = (r for r in map(json.loads, lines) if r.get("extracted"))
+            letters = iter_letters(records, officer, ui_lang, mobile, app_date.isoformat(), extra_context)
+            tmp_path = blob_store.path_for(f"export-{key[:16]}.{export_fmt}.part")
+            bar = st.progress(0.0, text="Rendering letters...")
+            with span("app.letter_export"):
+                n = export_letters(letters, tmp_path, export_fmt, on_progress=lambda d: bar.progress(min(1.0, d / max(1, len(lines))), text=f"{d} letters"))
+            bar.empty()
+            st.session_state.letter_export = ("blob:" + blob_store.put_file(tmp_path, f"export-{key[:16]}.{export_fmt}"), export_fmt, n)
+        if st.session_state.get("letter_export"):
+            export_ref, fmt, n = st.session_state.letter_export
+            mimes = {"zip": "application/zip", "pdf": "application/pdf", "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document"}
+            st.download_button(f"⬇️ {n} letters ({fmt.upper()})", lambda: blob_store.get(export_ref[5:]), file_name=f"ebillx_letters.{fmt}",
+                               mime=mimes[fmt], on_click="ignore")
+
+admin_token = os.environ.get("EBILLX_ADMIN_TOKEN")
+if admin_token and st.query_params.get("admin") == admin_token:
+    with st.expander("⏱️ Admin: stage timings"):
+        st.dataframe([{"stage": k, **v} for k, v in tracing.summary().items()], width="stretch")
+        ms = memory_stats()
+        st.caption("Sessions: " + ", ".join(f"{k}={v}" for k, v in ms.items()) +
+                   (" · blobs: " + ", ".join(f"{k}={v}" for k, v in blob_store.stats().items()) if blob_store is not None else ""))
+        st.caption("JSON parsing: " + ", ".join(f"{k}={v}" for k, v in parse_stats().items()))
+        gs = gemini_stats()
+        if gs:
+            st.caption("Gemini client: " + ", ".join(f"{k}={v}" for k, v in gs.items()))
+        usage = tracing.token_usage()
+        if usage:
+            st.dataframe([{"stage": k, **v} for k, v in usage.items()], width="stretch")
+        prom = tracing.prometheus_text() + parse_prometheus()
+        a1, a2 = st.columns(2)
+        a1.download_button("metrics.prom", prom, file_name="ebillx_metrics.prom", mime="text/plain", on_click="ignore")
+        if a2.button("Export metrics to file"):
+            tracing.flush()
+            st.caption("Written to " + tracing.export_prometheus())
 
 st.markdown("---")
 if ui_lang == "हिंदी":
     st.markdown("अभय द्वारा बनाया गया है")
 else:
     st.markdown("**created by Abhay soni**")
+
+ctx = get_script_run_ctx()
+if ctx is not None:
+    account(ctx.session_id, st.session_state, blob_store)
+    forget_idle(blobs=blob_store)
+tracing.record("app.rerun", time.perf_counter() - _run_start)
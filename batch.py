@@ -0,0 +1,158 @@
+import os, io, sys, csv, json, time, random, zipfile, argparse, threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import core
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png")
+RETRYABLE = ("429", "RESOURCE_EXHAUSTED", "503", "UNAVAILABLE", "rate limit", "overloaded")
+# Raised by the resilient client itself after its own retries: another pass would only add load
+CLIENT_GAVE_UP = ("circuit breaker open", "free gemini slot", "timed out", "timeout")
+CSV_FIELDS = ["file", "status", "error", "elapsed_s", "mode", "Consumer_ID", "Consumer_Name", "Discom_Name", "Division",
+              "Tariff_Category", "Billing_Date", "Units_Consumed_kWh", "Sanctioned_Load_kW", "Total_Amount_Payable_INR",
+              "calculated_total", "calc_source", "mistake_codes"]
+
+def iter_inputs(sources):
+    # sources: paths (files, dirs, zips) or (name, bytes/file-like) pairs from an uploader
+    for src in sources:
+        if isinstance(src, tuple):
+            name, data = src
+            if hasattr(data, "read"):
+                data = data.read()
+            if name.lower().endswith(".zip"):
+                yield from _iter_zip(name, io.BytesIO(data))
+            elif name.lower().endswith(IMAGE_EXTS):
+                yield name, data
+        elif os.path.isdir(src):
+            for root, _, files in os.walk(src):
+                for f in sorted(files):
+                    if f.lower().endswith(IMAGE_EXTS + (".zip",)):
+                        yield from iter_inputs([os.path.join(root, f)])
+        elif src.lower().endswith(".zip"):
+            with open(src, "rb") as f:
+                yield from _iter_zip(src, f)
+        elif src.lower().endswith(IMAGE_EXTS):
+            with open(src, "rb") as f:
+                yield src, f.read()
+
+def _iter_zip(name, fileobj):
+    with zipfile.ZipFile(fileobj) as zf:
+        for info in zf.infolist():
+            if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTS):
+                yield f"{name}:{info.filename}", zf.read(info)
+
+def is_retryable(err):
+    e = str(err or "").lower()
+    return any(r.lower() in e for r in RETRYABLE) and not any(r in e for r in CLIENT_GAVE_UP)
+
+def analyze_with_retry(name, data, extra_context="", retry=True, mode=None, delay=5.0):
+    # The Gemini client already retries each call with backoff; batch adds at most one later pass per bill for
+    # quota/overload errors that outlasted it, never for client timeouts or an open breaker
+    start = time.time()
+    res = core.analyze_bill(io.BytesIO(data), extra_context, mode)
+    attempts = 1
+    if retry and res["error"] is not None and is_retryable(res["error"]):
+        time.sleep(delay * random.uniform(0.5, 1.0))
+        res = core.analyze_bill(io.BytesIO(data), extra_context, mode)
+        attempts = 2
+    res["file"] = name
+    res["attempts"] = attempts
+    res["elapsed_s"] = round(time.time() - start, 3)
+    return res
+
+def run_batch(items, concurrency=4, extra_context="", on_result=None, retry=True, mode=None):
+    # Bounded submission window keeps at most 2x concurrency images in memory at once
+    concurrency = max(1, int(concurrency))
+    items = iter(items)
+    results = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        pending = set()
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < concurrency * 2:
+                try:
+                    name, data = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending.add(pool.submit(analyze_with_retry, name, data, extra_context, retry, mode))
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                try:
+                    res = fut.result()
+                except Exception as e:
+                    res = {"file": None, "error": str(e), "extracted": None, "calculation": None, "mistakes": None}
+                results += 1
+                if on_result:
+                    on_result(res)
+    return results
+
+def to_row(res):
+    ex = res.get("extracted") or {}
+    calc = (res.get("calculation") or {}).get("calculation", {}) or {}
+    row = {"file": res.get("file"), "status": "ok" if not res.get("error") else "error", "error": res.get("error") or "",
+           "elapsed_s": res.get("elapsed_s"), "mode": res.get("mode"), "calculated_total": calc.get("total"), "calc_source": res.get("calc_source"),
+           "mistake_codes": ";".join(m.get("Mistake_Code", "") for m in (res.get("mistakes") or []))}
+    for k in CSV_FIELDS:
+        if k not in row:
+            row[k] = ex.get(k, "")
+    return row
+
+class ResultWriter:
+    def __init__(self, fileobj, fmt="jsonl"):
+        self.fileobj = fileobj
+        self.fmt = fmt
+        self._lock = threading.Lock()
+        self._csv = None
+        if fmt == "csv":
+            self._csv = csv.DictWriter(fileobj, fieldnames=CSV_FIELDS, extrasaction="ignore")
+            self._csv.writeheader()
+
+    def write(self, res):
+        with self._lock:
+            if self._csv is not None:
+                self._csv.writerow(to_row(res))
+            else:
+                self.fileobj.write(json.dumps(res, ensure_ascii=False, default=str) + "\n")
+            self.fileobj.flush()
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Analyze many electricity bills headlessly")
+    ap.add_argument("inputs", nargs="+", help="bill images, directories or .zip archives")
+    ap.add_argument("-o", "--out", default="-", help="output file (default: stdout)")
+    ap.add_argument("-f", "--format", choices=["jsonl", "csv"], default=None)
+    ap.add_argument("-c", "--concurrency", type=int, default=int(os.environ.get("EBILLX_BATCH_CONCURRENCY", 4)))
+    ap.add_argument("--context", default="", help="extra context passed to every extraction")
+    ap.add_argument("--no-retry", action="store_true", help="skip the second pass for bills that hit Gemini quota/overload errors")
+    ap.add_argument("--mode", choices=core.ANALYSIS_MODES, default=None, help="analysis mode (default: EBILLX_ANALYSIS_MODE or two-call)")
+    args = ap.parse_args(argv)
+    fmt = args.format or ("csv" if args.out.lower().endswith(".csv") else "jsonl")
+    if core.client is None:
+        print("Gemini not configured. Set GEMINI_API_KEY in env", file=sys.stderr)
+    out = sys.stdout if args.out == "-" else open(args.out, "w", encoding="utf-8", newline="")
+    writer = ResultWriter(out, fmt)
+    counts = {"ok": 0, "error": 0}
+    start = time.time()
+
+    def on_result(res):
+        writer.write(res)
+        status = "error" if res.get("error") else "ok"
+        counts[status] += 1
+        done = counts["ok"] + counts["error"]
+        print(f"[{done}] {status:5} {res.get('elapsed_s', 0):6.2f}s {res.get('file')}" + (f" — {res['error']}" if res.get("error") else ""), file=sys.stderr)
+
+    try:
+        run_batch(iter_inputs(args.inputs), args.concurrency, args.context, on_result, not args.no_retry, args.mode)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    elapsed = time.time() - start
+    total = counts["ok"] + counts["error"]
+    print(f"{total} bills in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.2f}/s), {counts['error']} failed", file=sys.stderr)
+    for m, a in core.analysis_stats().items():
+        if a["runs"]:
+            print(f"  {m}: {a['runs']} runs, mean {a['mean_latency_s']}s, {a['parse_failures']} parse failures", file=sys.stderr)
+    return 1 if counts["error"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+import os, io, sys, json, random, argparse
+from PIL import Image, ImageDraw
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tariffs import TariffStore, calculate_bill
+
+SYNTH_TARIFF = {
+    "id": "SYNTH-DOMESTIC", "discom": "SYNTH DISCOM", "tariff_category": "DOMESTIC", "effective_from": "2024-04-01",
+    "fixed_per_kw": 60, "slabs": [{"upto": 100, "rate": 4.5}, {"upto": 300, "rate": 6.0}, {"upto": None, "rate": 7.5}], "duty_percent": 8,
+}
+SAMPLE_STORE = TariffStore.load()
+
+def render_bill(fields, size=(1240, 1754)):
+    # White A4-ish page on a dark background, like a phone photo of a paper bill
+    img = Image.new("RGB", (size[0] + 240, size[1] + 240), (45, 48, 52))
+    page = Image.new("RGB", size, (248, 246, 240))
+    d = ImageDraw.Draw(page)
+    y = 60
+    d.text((60, y), "ELECTRICITY BILL", fill=(0, 0, 0))
+    for k, v in fields.items():
+        if k == "Raw_Bill_Text":
+            continue
+        y += 48
+        d.text((60, y), f"{k.replace('_', ' ')}: {v}", fill=(10, 10, 10))
+    for i in range(20):
+        y += 36
+        d.text((60, y), "Energy charges as per tariff order. Pay by due date to avoid surcharge. " * 2, fill=(70, 70, 70))
+    img.paste(page, (120, 120))
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=90)
+    return buf.getvalue()
+
+def make_bill(i, rng, local_share=0.5):
+    local = rng.random() < local_share
+    units = rng.choice([rng.randint(40, 400), rng.randint(400, 1500)])
+    load = rng.choice([1, 2, 3, 5])
+    fields = {
+        "Consumer_ID": f"{rng.randint(10**9, 10**10 - 1)}",
+        "Consumer_Name": f"Consumer {i}",
+        "Sanctioned_Load_kW": str(load),
+        "Units_Consumed_kWh": str(units),
+        "Billing_Date": f"{rng.randint(1, 28):02d}-{rng.randint(1, 12):02d}-2025",
+        "Total_Amount_Payable_INR": "0",
+        "Discom_Name": "SAMPLE DISCOM" if local else "SYNTH DISCOM",
+        "Division": f"Division {rng.randint(1, 40)}",
+        "Tariff_Category": "DOMESTIC",
+        "Reading_Type": "Estimated" if rng.random() < 0.1 else "Actual",
+        "Raw_Bill_Text": "ELECTRICITY BILL " * rng.randint(20, 200),
+    }
+    tariff = SAMPLE_STORE.lookup(fields["Discom_Name"], "DOMESTIC") if local else SYNTH_TARIFF
+    calc = calculate_bill(fields, tariff or SYNTH_TARIFF)
+    total = calc["calculation"]["total"]
+    # About one bill in five is overcharged so CALC_ERR detection has work to do
+    billed = round(total * (rng.uniform(1.05, 1.3) if rng.random() < 0.2 else 1.0), 2)
+    fields["Total_Amount_Payable_INR"] = str(billed)
+    calc = calculate_bill(fields, tariff or SYNTH_TARIFF)
+    calc.pop("source", None)
+    return {"name": f"bill_{i:05d}.jpg", "extracted": fields, "calculation": calc}
+
+def make_corpus(n=50, seed=7, local_share=0.5, with_images=True):
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(n):
+        b = make_bill(i, rng, local_share)
+        if with_images:
+            b["image"] = render_bill(b["extracted"])
+        corpus.append(b)
+    return corpus
+
+def write_corpus(corpus, folder):
+    os.makedirs(folder, exist_ok=True)
+    for b in corpus:
+        with open(os.path.join(folder, b["name"]), "wb") as f:
+            f.write(b["image"])
+        with open(os.path.join(folder, os.path.splitext(b["name"])[0] + ".json"), "w", encoding="utf-8") as f:
+            json.dump(b["extracted"], f, ensure_ascii=False, indent=1)
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Write a synthetic bill corpus (JPEG + expected JSON)")
+    ap.add_argument("folder")
+    ap.add_argument("-n", type=int, default=50)
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--local-share", type=float, default=0.5, help="share of bills whose tariff is in tariffs.json")
+    args = ap.parse_args()
+    write_corpus(make_corpus(args.n, args.seed, args.local_share), args.folder)
+    print(f"wrote {args.n} bills to {args.folder}")
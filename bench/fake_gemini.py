@@ -0,0 +1,109 @@
+import json, time, random, hashlib, threading
+from types import SimpleNamespace
+
+LETTER_TEXT = (
+    "To,\nTHE EXECUTIVE ENGINEER\n\nSubject: Complaint regarding discrepancy in electricity bill\n\n"
+    "Respected Sir/Madam,\n\n" + "The billed amount does not match the applicable tariff for the units consumed. " * 12 +
+    "\n\nKindly re-check the bill and make necessary corrections.\n\nThank you.\n"
+)
+
+LETTER_TEMPLATE = (
+    "To,\nTHE EXECUTIVE ENGINEER\n[[DISCOM]]\nDate: [[DATE]]\n\nSubject: Complaint regarding discrepancy in electricity bill — Consumer ID [[CONSUMER_ID]]\n\n"
+    "Respected Sir/Madam,\n\nI, [[CONSUMER_NAME]] (Consumer ID: [[CONSUMER_ID]]), report the following problems in my bill:\n[[MISTAKES]]\n\n[[CONTEXT]]\n\n"
+    "Kindly re-check the bill and make necessary corrections. Please notify me at mobile [[MOBILE]].\n\nThank you,\n[[CONSUMER_NAME]]\n"
+)
+
+class FakeAPIError(Exception):
+    pass
+
+class FakeModels:
+    def __init__(self, corpus, latency_s=0.8, jitter_s=0.4, failure_rate=0.0, stream_chunks=12, fence_rate=0.3, seed=None):
+        self.corpus = corpus
+        self.latency_s = latency_s
+        self.jitter_s = jitter_s
+        self.failure_rate = failure_rate
+        self.stream_chunks = stream_chunks
+        self.fence_rate = fence_rate
+        self.rng = random.Random(seed)
+        self.calls = {"extract": 0, "calculate": 0, "fused": 0, "letter": 0, "letter_template": 0, "letter_stream": 0, "failed": 0}
+        self._lock = threading.Lock()
+
+    def _sleep(self, scale=1.0):
+        with self._lock:
+            d = max(0.0, self.latency_s + self.rng.uniform(-self.jitter_s, self.jitter_s))
+            fail = self.rng.random() < self.failure_rate
+            fail_kind = self.rng.choice(["429 RESOURCE_EXHAUSTED", "503 UNAVAILABLE"])
+        time.sleep(d * scale)
+        if fail:
+            with self._lock:
+                self.calls["failed"] += 1
+            raise FakeAPIError(fail_kind + ": fake server injected failure")
+
+    def _count(self, kind):
+        with self._lock:
+            self.calls[kind] += 1
+
+    def _bill_for(self, contents):
+        # Pick a corpus bill deterministically from the image payload so repeated uploads agree
+        blob = b""
+        for c in contents:
+            data = getattr(getattr(c, "inline_data", None), "data", None)
+            if data:
+                blob = data
+            elif hasattr(c, "tobytes"):
+                blob = c.tobytes()
+        idx = int(hashlib.sha256(blob).hexdigest(), 16) % len(self.corpus) if blob else 0
+        return self.corpus[idx]
+
+    def _fence(self, text):
+        with self._lock:
+            fenced = self.rng.random() < self.fence_rate
+        return f"```json\n{text}\n```" if fenced else text
+
+    def _response(self, text, prompt):
+        usage = SimpleNamespace(prompt_token_count=len(prompt) // 4 + 258, candidates_token_count=len(text) // 4,
+                                total_token_count=len(prompt) // 4 + 258 + len(text) // 4)
+        return SimpleNamespace(text=text, usage_metadata=usage)
+
+    def generate_content(self, model, contents, config=None):
+        prompt = next((c for c in contents if isinstance(c, str)), "")
+        if config is not None and getattr(config, "response_schema", None) is not None:
+            self._count("fused")
+            self._sleep(1.3)
+            bill = self._bill_for(contents)
+            text = json.dumps({"extracted": bill["extracted"], "calculation": bill["calculation"]}, ensure_ascii=False)
+        elif "letter template" in prompt:
+            self._count("letter_template")
+            self._sleep(1.5)
+            text = LETTER_TEMPLATE
+        elif "letter writer" in prompt:
+            self._count("letter")
+            self._sleep(2.0)
+            text = LETTER_TEXT
+        elif "billing expert" in prompt:
+            self._count("calculate")
+            self._sleep()
+            bill = json.loads(prompt.split("extra context: ", 1)[1])
+            match = next((b for b in self.corpus if b["extracted"]["Consumer_ID"] == bill.get("Consumer_ID")), self.corpus[0])
+            text = self._fence(json.dumps(match["calculation"], ensure_ascii=False))
+        else:
+            self._count("extract")
+            self._sleep()
+            text = self._fence(json.dumps(self._bill_for(contents)["extracted"], ensure_ascii=False))
+        return self._response(text, prompt)
+
+    def generate_content_stream(self, model, contents, config=None):
+        prompt = next((c for c in contents if isinstance(c, str)), "")
+        self._count("letter_stream")
+        self._sleep(0.3)
+        n = max(1, self.stream_chunks)
+        step = max(1, len(LETTER_TEXT) // n)
+        per_chunk = self.latency_s * 1.7 / n
+        for i in range(0, len(LETTER_TEXT), step):
+            time.sleep(per_chunk)
+            chunk = LETTER_TEXT[i:i + step]
+            yield self._response(chunk, prompt) if i + step >= len(LETTER_TEXT) else SimpleNamespace(text=chunk, usage_metadata=None)
+
+class FakeClient:
+    def __init__(self, corpus, **kwargs):
+        self.models = FakeModels(corpus, **kwargs)
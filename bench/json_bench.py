@@ -0,0 +1,84 @@
+import os, re, sys, json, time, argparse
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import tracing
+tracing.TRACE_ENABLED = False  # measure parsing, not trace bookkeeping
+import payload
+
+def legacy_safe_clean_json(text):
+    # The regex recovery core.py used before payload.extract_json, kept verbatim for comparison
+    if not text:
+        return None
+    s = text.strip()
+    s = re.sub(r"^```(?:json)?", "", s, flags=re.IGNORECASE).strip()
+    s = re.sub(r"```$", "", s).strip()
+    s = re.sub(r'[\u200b-\u200f\u202a-\u202e]', '', s)
+    try:
+        return json.loads(s)
+    except:
+        m = re.search(r"\{.*\}", s, flags=re.DOTALL)
+        if m:
+            try:
+                return json.loads(m.group(0))
+            except:
+                pass
+        m2 = re.search(r"\[.*\]", s, flags=re.DOTALL)
+        if m2:
+            try:
+                return json.loads(m2.group(0))
+            except:
+                pass
+    return None
+
+BILL = {"Consumer_ID": "1234567890", "Consumer_Name": "Ram Kumar", "Sanctioned_Load_kW": "2", "Units_Consumed_kWh": "245",
+        "Billing_Date": "05/03/2024", "Total_Amount_Payable_INR": "1,734.50", "Discom_Name": "PVVNL", "Division": "EDD-II Meerut",
+        "Tariff_Category": "LMV-1", "Reading_Type": "Actual", "Raw_Bill_Text": "N/A"}
+
+def make_cases(raw_kb):
+    bill = json.dumps(BILL, ensure_ascii=False)
+    big = json.dumps(dict(BILL, Raw_Bill_Text=("बिल विवरण {slab} [rate] \"quoted\" " * 40 * raw_kb)), ensure_ascii=False)
+    calc = json.dumps({"discom": "PVVNL", "fixed_per_kw": "110", "slabs": [{"range": "0-100", "rate": "5.5"}, {"range": "101-150", "rate": "6"}],
+                       "duty": "5%", "calculation": {"fixed": 220, "energy_details": [{"slab": "0-100", "units": 100, "rate": 5.5, "amount": 550}],
+                                                     "energy_total": 1420, "duty": 71, "total": 1711}, "bill_correct": "no", "difference": "23.5"})
+    # (name, model output, expected value)
+    return [
+        ("clean", bill, BILL),
+        ("fenced", "```json\n" + bill + "\n```", BILL),
+        ("prose", "Here is the extracted data:\n" + bill + "\nLet me know if you need anything else.", BILL),
+        ("raw_text", "```json\n" + big + "\n```", json.loads(big)),
+        ("braces_in_prose", "Values in {curly} braces are estimates.\n" + calc + "\nNote: {see above}.", json.loads(calc)),
+        ("two_objects", bill + "\n\nCorrected: " + bill, BILL),
+        ("truncated", bill[:-40], None),
+        # Cut inside "calculation": the first slab is the first complete object, but only the outer one may count
+        ("truncated_calc", calc[:calc.index('"total"')], None),
+    ]
+
+def timeit(fn, text, min_s):
+    n, start = 0, time.perf_counter()
+    while True:
+        for _ in range(50):
+            fn(text)
+        n += 50
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_s:
+            return elapsed / n * 1e6
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Micro-benchmark: legacy regex JSON recovery vs payload.extract_json + schema coercion")
+    ap.add_argument("--min-s", type=float, default=0.3, help="minimum timing window per case")
+    ap.add_argument("--raw-kb", type=int, default=8, help="approximate Raw_Bill_Text size for the raw_text case")
+    args = ap.parse_args(argv)
+    print(f"{'case':<16} {'legacy µs':>10} {'new µs':>10} {'speedup':>8}  {'legacy':<10} {'new':<10} {'+schema µs':>10}")
+    for name, text, expected in make_cases(args.raw_kb):
+        old, new = legacy_safe_clean_json(text), payload.extract_json(text)
+        coerce = payload.coerce_calculation if "calculation" in text else payload.coerce_bill
+        # Recovered output that the schema then rejects (missing required keys) is reported as such
+        ok = lambda v: ("ok" if v == expected else "wrong") if expected is not None else (
+            ("recovered" if coerce(v)[0] is not None else "rejected") if isinstance(v, dict) else "failed")
+        t_old = timeit(legacy_safe_clean_json, text, args.min_s)
+        t_new = timeit(payload.extract_json, text, args.min_s)
+        t_schema = timeit(lambda t: coerce(payload.extract_json(t)), text, args.min_s)
+        print(f"{name:<16} {t_old:>10.1f} {t_new:>10.1f} {t_old / t_new:>7.1f}x  {ok(old):<10} {ok(new):<10} {t_schema:>10.1f}")
+    print(json.dumps(payload.parse_stats()))
+
+if __name__ == "__main__":
+    main()
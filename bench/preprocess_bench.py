@@ -0,0 +1,80 @@
+import os, io, sys, json, time, argparse, statistics
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import core
+from image_prep import PrepConfig, prepare_image
+from tariffs import norm_key
+
+FIELDS = ["Consumer_ID", "Sanctioned_Load_kW", "Units_Consumed_kWh", "Billing_Date", "Total_Amount_Payable_INR", "Discom_Name", "Tariff_Category"]
+
+def load_samples(folder):
+    for f in sorted(os.listdir(folder)):
+        if f.lower().endswith((".jpg", ".jpeg", ".png")):
+            truth = None
+            tp = os.path.join(folder, os.path.splitext(f)[0] + ".json")
+            if os.path.exists(tp):
+                with open(tp, encoding="utf-8") as fh:
+                    truth = json.load(fh)
+            with open(os.path.join(folder, f), "rb") as fh:
+                yield f, fh.read(), truth
+
+def field_accuracy(extracted, truth):
+    if not extracted or not truth:
+        return None
+    fields = [k for k in FIELDS if k in truth]
+    if not fields:
+        return None
+    return sum(norm_key(extracted.get(k)) == norm_key(truth[k]) for k in fields) / len(fields)
+
+def run(folder, configs, call_model):
+    core.extract_cache = None
+    report = {}
+    samples = list(load_samples(folder))
+    for name, cfg in configs.items():
+        rows = []
+        for fname, data, truth in samples:
+            prepared, _, stats = prepare_image(data, cfg)
+            row = {"file": fname, "bytes": stats["bytes_after"], "prep_ms": stats["prep_ms"]}
+            if call_model:
+                core.prep_config = cfg
+                t0 = time.perf_counter()
+                extracted, err = core.call_gemini_extract(io.BytesIO(data))
+                row["extract_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+                row["error"] = err
+                row["accuracy"] = field_accuracy(extracted, truth)
+            rows.append(row)
+        summary = {"files": len(rows), "mean_bytes": round(statistics.mean(r["bytes"] for r in rows)) if rows else 0,
+                   "mean_prep_ms": round(statistics.mean(r["prep_ms"] for r in rows), 1) if rows else 0}
+        if call_model and rows:
+            summary["mean_extract_ms"] = round(statistics.mean(r["extract_ms"] for r in rows), 1)
+            accs = [r["accuracy"] for r in rows if r["accuracy"] is not None]
+            summary["field_accuracy"] = round(statistics.mean(accs), 3) if accs else None
+            summary["errors"] = sum(1 for r in rows if r["error"])
+        report[name] = {"summary": summary, "rows": rows}
+    return report
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Compare raw vs preprocessed bill uploads (size, latency, extraction accuracy)")
+    ap.add_argument("folder", help="folder of bill images; optional <name>.json next to each holds expected field values")
+    ap.add_argument("--max-dim", type=int, nargs="*", default=[2400, 1600, 1200])
+    ap.add_argument("--format", default="JPEG")
+    ap.add_argument("--quality", type=int, default=80)
+    ap.add_argument("--offline", action="store_true", help="only measure payload size and prep time")
+    ap.add_argument("--ablate", action="store_true", help="also run each size with crop on/off and grayscale on/off")
+    args = ap.parse_args(argv)
+    configs = {"raw": PrepConfig(enabled=False)}
+    for d in args.max_dim:
+        configs[f"prep-{d}"] = PrepConfig(enabled=True, max_dim=d, fmt=args.format, quality=args.quality)
+        if args.ablate:
+            for crop in (False, True):
+                for gray in (False, True):
+                    configs[f"prep-{d}-crop{int(crop)}-gray{int(gray)}"] = PrepConfig(enabled=True, max_dim=d, grayscale=gray, crop=crop,
+                                                                                    fmt=args.format, quality=args.quality)
+    call_model = not args.offline and core.client is not None
+    if not args.offline and not call_model:
+        print("Gemini not configured; running offline (size/prep time only)", file=sys.stderr)
+    report = run(args.folder, configs, call_model)
+    for name, r in report.items():
+        print(name, json.dumps(r["summary"]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import os, io, sys, json, time, argparse, resource, tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import core
+import batch
+from tracing import percentile
+from corpus import make_corpus
+from fake_gemini import FakeClient
+from gemini_client import ResilientClient
+
+SCENARIOS = ["extract", "calculate", "letter", "letter_template", "letter_stream", "analyze_two_call", "analyze_fused", "batch"]
+
+def _consume_stream(bill):
+    metrics = {}
+    for _ in core.stream_gemini_letter(bill["extracted"], bill["calculation"], [], "", "EXECUTIVE ENGINEER", "English", "9999999999", "2025-01-01", metrics):
+        pass
+    return None, metrics.get("ttfb_s")
+
+def scenario_fn(name):
+    if name == "extract":
+        return lambda b: (core.call_gemini_extract(io.BytesIO(b["image"]))[1], None)
+    if name == "calculate":
+        return lambda b: (core.calculate(b["extracted"])[1], None)
+    if name == "letter":
+        return lambda b: (core.call_gemini_letter(b["extracted"], b["calculation"], [], "", "EXECUTIVE ENGINEER", "English", "9999999999", "2025-01-01")[1], None)
+    if name == "letter_template":
+        return lambda b: (core.template_letter(b["extracted"], [], "", "EXECUTIVE ENGINEER", "English", "9999999999", "2025-01-01")[1], None)
+    if name == "letter_stream":
+        return _consume_stream
+    if name == "analyze_two_call":
+        return lambda b: (core.analyze_bill(io.BytesIO(b["image"]), "", "two-call")["error"], None)
+    if name == "analyze_fused":
+        return lambda b: (core.analyze_bill(io.BytesIO(b["image"]), "", "fused")["error"], None)
+    raise ValueError(name)
+
+def drive(fn, corpus, concurrency):
+    latencies, ttfbs, errors = [], [], 0
+
+    def one(b):
+        t0 = time.perf_counter()
+        try:
+            err, ttfb = fn(b)
+        except Exception as e:
+            err, ttfb = str(e), None
+        return time.perf_counter() - t0, err, ttfb
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for lat, err, ttfb in pool.map(one, corpus):
+            latencies.append(lat)
+            if ttfb is not None:
+                ttfbs.append(ttfb)
+            if err:
+                errors += 1
+    return time.perf_counter() - start, latencies, ttfbs, errors
+
+def drive_batch(corpus, concurrency):
+    latencies, errors = [], [0]
+
+    def on_result(res):
+        latencies.append(res.get("elapsed_s") or 0.0)
+        if res.get("error"):
+            errors[0] += 1
+
+    start = time.perf_counter()
+    batch.run_batch(((b["name"], b["image"]) for b in corpus), concurrency, "", on_result)
+    return time.perf_counter() - start, latencies, [], errors[0]
+
+def run(scenarios, concurrencies, corpus, fake):
+    rows = []
+    for name in scenarios:
+        for c in concurrencies:
+            tracemalloc.start()
+            elapsed, lats, ttfbs, errors = drive_batch(corpus, c) if name == "batch" else drive(scenario_fn(name), corpus, c)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            lats.sort()
+            ttfbs.sort()
+            rows.append({
+                "scenario": name, "concurrency": c, "n": len(lats), "errors": errors,
+                "throughput_per_s": round(len(lats) / elapsed, 2) if elapsed else None,
+                "p50_ms": round(percentile(lats, 0.5) * 1000, 1) if lats else None,
+                "p95_ms": round(percentile(lats, 0.95) * 1000, 1) if lats else None,
+                "p99_ms": round(percentile(lats, 0.99) * 1000, 1) if lats else None,
+                "ttfb_p50_ms": round(percentile(ttfbs, 0.5) * 1000, 1) if ttfbs else None,
+                "py_peak_mb": round(peak / 2**20, 1),
+                "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            })
+            print(json.dumps(rows[-1]), file=sys.stderr)
+    rows.append({"scenario": "fake_server_calls", **fake.models.calls})
+    return rows
+
+def print_table(rows):
+    cols = ["scenario", "concurrency", "n", "errors", "throughput_per_s", "p50_ms", "p95_ms", "p99_ms", "ttfb_p50_ms", "py_peak_mb", "max_rss_mb"]
+    print(" | ".join(cols))
+    for r in rows:
+        if "concurrency" in r:
+            print(" | ".join(str(r.get(c, "")) for c in cols))
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Offline throughput/latency benchmark against a fake Gemini client")
+    ap.add_argument("-s", "--scenario", nargs="*", choices=SCENARIOS, default=SCENARIOS)
+    ap.add_argument("-c", "--concurrency", type=int, nargs="*", default=[1, 4, 16])
+    ap.add_argument("-n", type=int, default=40, help="bills in the synthetic corpus")
+    ap.add_argument("--latency", type=float, default=0.8, help="mean fake model latency in seconds")
+    ap.add_argument("--jitter", type=float, default=0.4)
+    ap.add_argument("--failure-rate", type=float, default=0.0)
+    ap.add_argument("--local-share", type=float, default=0.5, help="share of bills matched by the local tariff table")
+    ap.add_argument("--cache", action="store_true", help="keep the extraction and letter caches enabled")
+    ap.add_argument("--history", action="store_true", help="record bills in the consumer history store")
+    ap.add_argument("--no-resilience", action="store_true", help="call the fake client directly, without retries/breaker")
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--json", help="write results to this file")
+    args = ap.parse_args(argv)
+
+    corpus = make_corpus(args.n, args.seed, args.local_share)
+    fake = FakeClient(corpus, latency_s=args.latency, jitter_s=args.jitter, failure_rate=args.failure_rate, seed=args.seed)
+    core.client = fake if args.no_resilience else ResilientClient(client=fake, base_delay_s=min(0.5, args.latency))
+    if not args.cache:
+        core.extract_cache = None
+        core.letter_cache = None
+    if not args.history:
+        core.history_store = None
+    rows = run(args.scenario, args.concurrency, corpus, fake)
+    print_table(rows)
+    print("fake server calls:", json.dumps(rows[-1]))
+    if core.gemini_stats():
+        print("client:", json.dumps(core.gemini_stats()))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=1)
+
+if __name__ == "__main__":
+    main()
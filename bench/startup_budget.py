@@ -0,0 +1,50 @@
+import os, sys, argparse, subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def import_times(module):
+    # Runs a fresh interpreter with -X importtime and returns (total_ms, [(cumulative_ms, module), ...])
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    env.pop("GEMINI_API_KEY", None)
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=ROOT, env=env,
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr[-2000:])
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cum_us, name = line.split(":", 1)[1].split("|")
+        rows.append((int(cum_us) / 1000, name[1:]))
+    top_level = [r for r in rows if not r[1].startswith(" ")]
+    total = next((ms for ms, name in reversed(rows) if name.strip() == module), sum(ms for ms, _ in top_level))
+    return total, rows
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Fail if importing a module in a fresh process exceeds a time budget")
+    ap.add_argument("module", nargs="?", default="core")
+    ap.add_argument("--budget-ms", type=float, default=float(os.environ.get("EBILLX_IMPORT_BUDGET_MS", 300)))
+    ap.add_argument("--runs", type=int, default=3, help="take the best of N runs to reduce noise")
+    ap.add_argument("--top", type=int, default=10)
+    ap.add_argument("--forbid", nargs="*", default=["google.genai", "fpdf", "docx", "requests", "streamlit_lottie"],
+                    help="modules that must not be imported eagerly")
+    args = ap.parse_args(argv)
+    best = None
+    for _ in range(max(1, args.runs)):
+        total, rows = import_times(args.module)
+        if best is None or total < best[0]:
+            best = (total, rows)
+    total, rows = best
+    names = {name.strip() for _, name in rows}
+    eager = [m for m in args.forbid if m in names]
+    print(f"import {args.module}: {total:.0f} ms (budget {args.budget_ms:.0f} ms)")
+    for ms, name in sorted(rows, reverse=True)[:args.top]:
+        print(f"  {ms:8.1f} ms  {name.strip()}")
+    if eager:
+        print("eagerly imported: " + ", ".join(eager))
+    ok = total <= args.budget_ms and not eager
+    print("OK" if ok else "OVER BUDGET")
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
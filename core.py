@@ -0,0 +1,604 @@
+import time
+_import_start = time.perf_counter()
+import os, sys
+import io, json, re, random, logging, hashlib, threading, importlib.util
+from collections import OrderedDict
+from PIL import Image
+from extract_cache import ExtractCache, make_key, CACHE_DIR
+from tariffs import TariffStore, TARIFF_FILE, calculate_locally
+from image_prep import PrepConfig, prepare_image
+from history import HistoryStore
+from gemini_client import ResilientClient
+from session_store import BlobStore
+from payload import extract_json, coerce_bill, coerce_calculation, parse_number, is_missing
+from documents import create_pdf_buffer, create_docx_buffer
+# google.genai, fpdf and docx are imported on first use; together they dominate cold start
+import tracing
+from tracing import span, traced
+
+log = logging.getLogger("ebillx.core")
+
+def genai_available():
+    try:
+        return importlib.util.find_spec("google.genai") is not None
+    except (ImportError, ValueError):
+        return False
+
+def genai_types():
+    from google.genai import types
+    return types
+
+@traced("gemini.get_client")
+def get_client():
+    key = None
+    if "GEMINI_API_KEY" in os.environ:
+        key = os.environ["GEMINI_API_KEY"]
+    elif "streamlit" in sys.modules:
+        try:
+            key = sys.modules["streamlit"].secrets["GEMINI_API_KEY"]
+        except Exception:
+            key = None
+    if not key or not genai_available():
+        return None
+    return ResilientClient(api_key=key)
+
+tracing.record("core.import", time.perf_counter() - _import_start)
+
+client = get_client()
+
+def gemini_degraded():
+    # True while the circuit breaker is open: callers should go straight to local fallbacks
+    return client is not None and hasattr(client, "degraded") and client.degraded()
+
+def gemini_stats():
+    return client.stats() if client is not None and hasattr(client, "stats") else None
+
+EXTRACT_PROMPT_VERSION = "extract-v2"
+
+def get_extract_cache():
+    try:
+        return ExtractCache(
+            ttl_seconds=int(os.environ.get("EBILLX_CACHE_TTL", 30 * 24 * 3600)),
+            max_entries=int(os.environ.get("EBILLX_CACHE_MAX_ENTRIES", 5000)),
+        )
+    except Exception:
+        return None
+
+extract_cache = get_extract_cache()
+
+LETTER_PROMPT_VERSION = "letter-v1"
+LETTER_TEMPLATES = os.environ.get("EBILLX_LETTER_TEMPLATES", "0").strip().lower() in ("1", "true", "yes", "on")
+
+def get_letter_cache():
+    try:
+        return ExtractCache(
+            path=os.path.join(CACHE_DIR, "letters.sqlite3"), table="letter_cache",
+            ttl_seconds=int(os.environ.get("EBILLX_LETTER_CACHE_TTL", 30 * 24 * 3600)),
+            max_entries=int(os.environ.get("EBILLX_LETTER_CACHE_MAX_ENTRIES", 2000)),
+        )
+    except Exception:
+        return None
+
+letter_cache = get_letter_cache()
+
+def get_blob_store():
+    try:
+        return BlobStore()
+    except Exception:
+        return None
+
+blob_store = get_blob_store()
+
+def get_tariff_store():
+    return TariffStore.load(os.environ.get("EBILLX_TARIFFS", TARIFF_FILE))
+
+tariff_store = get_tariff_store()
+
+prep_config = PrepConfig()
+
+def get_history_store():
+    if os.environ.get("EBILLX_HISTORY", "1").strip().lower() in ("0", "false", "no", "off"):
+        return None
+    try:
+        return HistoryStore()
+    except Exception:
+        return None
+
+history_store = get_history_store()
+
+def extract_cache_key(data, extra_context=""):
+    return make_key(data, EXTRACT_PROMPT_VERSION + "|" + prep_config.signature(), extra_context)
+
+def cached_extract(cache_key):
+    # Entries cached before schema coercion existed are coerced on the way out; it is idempotent for newer ones
+    cached = extract_cache.get(cache_key)
+    return coerce_bill(cached)[0] if cached is not None else None
+
+def lookup_extract(data, extra_context=""):
+    # Returns (cache_key, cached bill or None); the key is None when the cache is off or unreadable
+    if extract_cache is None:
+        return None, None
+    try:
+        key = extract_cache_key(data, extra_context)
+        return key, cached_extract(key)
+    except Exception:
+        return None, None
+
+def image_part(data):
+    try:
+        with span("image.prepare"):
+            prepared, mime, _ = prepare_image(data, prep_config)
+        return genai_types().Part.from_bytes(data=prepared, mime_type=mime)
+    except Exception:
+        return Image.open(io.BytesIO(data))
+
+@traced("gemini.extract", returns_error=True)
+def call_gemini_extract(image_file, extra_context="", cache_key=None):
+    # cache_key: the caller already looked the bill up (and missed); skip the lookup and store under this key
+    data = image_file.getvalue() if hasattr(image_file, "getvalue") else image_file.read()
+    if cache_key is None:
+        cache_key, cached = lookup_extract(data, extra_context)
+        if cached is not None:
+            return cached, None
+    if client is None:
+        return None, "Gemini client not configured"
+    try:
+        img = image_part(data)
+        prompt = (
+            "You are an expert extractor. From the provided electricity bill image, return a JSON only with keys: "
+            "Consumer_ID, Consumer_Name, Sanctioned_Load_kW, Units_Consumed_kWh, Billing_Date, Total_Amount_Payable_INR, Discom_Name, Division, Tariff_Category, Reading_Type, Raw_Bill_Text. "
+            "Reading_Type is the meter reading status printed on the bill (e.g. Actual, Estimated, Average, IDF). "
+            "If any value is missing, set it to 'N/A'. Provide values as simple strings or numbers. Context: " + extra_context
+        )
+        t0 = time.perf_counter()
+        resp = client.models.generate_content(model="gemini-2.5-flash", contents=[prompt, img])
+        tracing.record_tokens("gemini.extract", resp)
+        log.info("extract call took %.0f ms", (time.perf_counter() - t0) * 1000)
+        text = getattr(resp, "text", None) or str(resp)
+        parsed, problems = coerce_bill(extract_json(text))
+        if parsed is None:
+            return None, "Gemini returned non-JSON or unparsable response"
+        if problems:
+            log.info("extract coerced with problems: %s", "; ".join(problems))
+        if cache_key is not None:
+            try:
+                extract_cache.put(cache_key, parsed)
+            except Exception:
+                pass
+        return parsed, None
+    except Exception as e:
+        return None, str(e)
+
+@traced("gemini.calculate", returns_error=True)
+def call_gemini_calculate_and_explain(bill_payload, extra_context=""):
+    if client is None:
+        return None, "Gemini client not configured"
+    try:
+        prompt = (
+            "You are a billing expert. Given the extracted bill data and raw text, identify the applicable discom, division, tariff category, fixed charge, slab structure (range and rate), duty percentage and any surcharge. "
+            "Then calculate slab-wise energy charges, fixed charges and duty and present a full breakdown and final total. Finally compare your calculated total with the provided Total_Amount_Payable_INR and output a JSON with keys: discom, division, tariff_category, fixed_per_kw, slabs (list of {range, rate}), duty, calculation {fixed, energy_details, energy_total, duty, total}, bill_correct (true/false), difference. Use the bill data below and extra context: "
+            + json.dumps(bill_payload, ensure_ascii=False)
+        )
+        resp = client.models.generate_content(model="gemini-2.5-flash", contents=[prompt])
+        tracing.record_tokens("gemini.calculate", resp)
+        text = getattr(resp, "text", None) or str(resp)
+        parsed, problems = coerce_calculation(extract_json(text))
+        if parsed is None:
+            return None, "Gemini calculation returned non-JSON or unparsable response"
+        if problems:
+            log.info("calculation coerced with problems: %s", "; ".join(problems))
+        return parsed, None
+    except Exception as e:
+        return None, str(e)
+
+def letter_prompt(bill, calculation_json, selected_mistakes, extra_context, officer, lang, mobile, app_date):
+    return (
+        f"You are a formal government letter writer. Using the bill data, calculation results and user context, write a formal complaint letter addressed to {officer}. "
+        f"Include the identified mistakes and request action. Language: {lang}. Mobile: {mobile}. Date: {app_date}. "
+        "Bill data:\n" + json.dumps(bill, ensure_ascii=False) + "\nCalculation:\n" + json.dumps(calculation_json, ensure_ascii=False) + "\nMistakes:\n" + json.dumps(selected_mistakes, ensure_ascii=False) + "\nUser context:\n" + extra_context + "\nOutput only the final letter text."
+    )
+
+def canonical_hash(*parts):
+    # Key order and whitespace do not change the hash, so re-submitting the same inputs always hits
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(json.dumps(part, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+def letter_cache_key(bill, calculation_json, selected_mistakes, extra_context, officer, lang, mobile, app_date):
+    return canonical_hash(LETTER_PROMPT_VERSION, bill, calculation_json, selected_mistakes, (extra_context or "").strip(),
+                          officer, lang, str(mobile or "").strip(), str(app_date or ""))
+
+def cached_letter(key):
+    if letter_cache is None:
+        return None
+    return letter_cache.get(key)
+
+def store_letter(key, text):
+    if letter_cache is not None and text:
+        letter_cache.put(key, text)
+
+@traced("gemini.letter", returns_error=True)
+def call_gemini_letter(bill, calculation_json, selected_mistakes, extra_context, officer, lang, mobile, app_date):
+    key = letter_cache_key(bill, calculation_json, selected_mistakes, extra_context, officer, lang, mobile, app_date)
+    hit = cached_letter(key)
+    if hit is not None:
+        return hit, None
+    if client is None:
+        return None, "Gemini client not configured"
+    try:
+        prompt = letter_prompt(bill, calculation_json, selected_mistakes, extra_context, officer, lang, mobile, app_date)
+        resp = client.models.generate_content(model="gemini-2.5-flash", contents=[prompt])
+        tracing.record_tokens("gemini.letter", resp)
+        text = getattr(resp, "text", None) or str(resp)
+        clean = re.sub(r'[\u200b-\u200f\u202a-\u202e]', '', text).strip()
+        store_letter(key, clean)
+        return clean, None
+    except Exception as e:
+        return None, str(e)
+
+def stream_gemini_letter(bill, calculation_json, selected_mistakes, extra_context, officer, lang, mobile, app_date, metrics=None):
+    # Yields cleaned text chunks as they arrive; errors propagate so the caller can fall back mid-stream
+    metrics = metrics if metrics is not None else {}
+    start = time.perf_counter()
+    key = letter_cache_key(bill, calculation_json, selected_mistakes, extra_context, officer, lang, mobile, app_date)
+    hit = cached_letter(key)
+    if hit is not None:
+        elapsed = round(time.perf_counter() - start, 3)
+        metrics.update({"ttfb_s": elapsed, "total_s": elapsed, "chunks": 1, "chars": len(hit), "cached": True})
+        yield hit
+        return
+    if client is None:
+        raise RuntimeError("Gemini client not configured")
+    prompt = letter_prompt(bill, calculation_json, selected_mistakes, extra_context, officer, lang, mobile, app_date)
+    metrics.update({"ttfb_s": None, "total_s": None, "chunks": 0, "chars": 0, "cached": False})
+    parts = []
+    last = None
+    for chunk in client.models.generate_content_stream(model="gemini-2.5-flash", contents=[prompt]):
+        last = chunk
+        text = re.sub(r'[\u200b-\u200f\u202a-\u202e]', '', getattr(chunk, "text", None) or "")
+        if not text:
+            continue
+        if metrics["ttfb_s"] is None:
+            metrics["ttfb_s"] = round(time.perf_counter() - start, 3)
+        metrics["chunks"] += 1
+        metrics["chars"] += len(text)
+        parts.append(text)
+        yield text
+    metrics["total_s"] = round(time.perf_counter() - start, 3)
+    store_letter(key, "".join(parts).strip())
+    tracing.record("gemini.letter_stream", metrics["total_s"], ttfb_ms=round((metrics["ttfb_s"] or 0) * 1000, 1))
+    tracing.record_tokens("gemini.letter_stream", last)
+    log.info("letter stream: first chunk %.2fs, total %.2fs, %d chunks", metrics["ttfb_s"] or 0, metrics["total_s"], metrics["chunks"])
+
+def generate_local_simple_letter(bill, mistakes, officer, lang, mobile, app_date, extra_context):
+    points = "\n".join(["- " + (m.get("Description_Hindi") or m.get("description") or "") for m in mistakes]) if mistakes else ""
+    context_para = extra_context if extra_context and extra_context.strip() != "" else ""
+    if lang == "हिंदी":
+        letter = f"""सेवा में,
+{officer}
+{bill.get('Discom_Name','')}
+दिनांक: {app_date}
+
+विषय: बिजली बिल में विसंगति के संबंध में शिकायत — उपभोक्ता संख्या {bill.get('Consumer_ID','N/A')}
+
+मान्यवर,
+
+मैं, {bill.get('Consumer_Name','N/A')} (उपभोक्ता संख्या: {bill.get('Consumer_ID','N/A')}), सूचित करता/करती हूँ कि मेरे बिल में निम्नलिखित विसंगतियाँ पाई गईं:
+{points}
+
+{context_para}
+
+कृपया बिल की जाँच कर आवश्यक सुधार करें। कृपया कार्रवाई की सूचना मेरे मोबाइल {mobile} पर उपलब्ध कराएँ।
+
+धन्यवाद,
+{bill.get('Consumer_Name','N/A')}
+"""
+    else:
+        letter = f"""To,
+{officer}
+{bill.get('Discom_Name','')}
+Date: {app_date}
+
+Subject: Complaint regarding discrepancy in electricity bill — Consumer ID {bill.get('Consumer_ID','N/A')}
+
+Respected Sir/Madam,
+
+I, {bill.get('Consumer_Name','N/A')} (Consumer ID: {bill.get('Consumer_ID','N/A')}), wish to inform you of the following discrepancies in my bill:
+{points}
+
+{context_para}
+
+Kindly re-check the bill and make necessary corrections. Please notify me at mobile {mobile}.
+
+Thank you,
+{bill.get('Consumer_Name','N/A')}
+"""
+    return letter
+
+
+# Template mode: the model writes one generic letter body per (mistake codes, officer, language) with placeholders,
+# and consumer-specific fields are filled in locally, so most complaints of a common type need no LLM call
+TEMPLATE_REQUIRED = ("[[CONSUMER_ID]]", "[[MISTAKES]]")
+TEMPLATE_FIELDS = ("[[CONSUMER_NAME]]", "[[CONSUMER_ID]]", "[[DISCOM]]", "[[DATE]]", "[[MOBILE]]", "[[MISTAKES]]", "[[CONTEXT]]")
+
+def mistake_codes(mistakes):
+    return sorted({str(m.get("Mistake_Code") or "OTHER").upper() for m in mistakes or []})
+
+def letter_template_key(mistakes, officer, lang):
+    return "tpl:" + canonical_hash(LETTER_PROMPT_VERSION, mistake_codes(mistakes), officer, lang)
+
+def letter_template_prompt(codes, officer, lang):
+    return (
+        f"You are a formal government letter writer. Write a reusable formal complaint letter template addressed to {officer} about an electricity bill "
+        f"with these problems: {', '.join(codes) or 'general discrepancy'}. Language: {lang}. "
+        "Do not invent any names, numbers or amounts. Use these placeholders exactly where the consumer-specific values belong: "
+        + ", ".join(TEMPLATE_FIELDS) + ". [[MISTAKES]] will be replaced by a bulleted list of the detected problems and "
+        "[[CONTEXT]] by the consumer's own remarks (possibly empty), each on its own line. Output only the template text."
+    )
+
+@traced("gemini.letter_template", returns_error=True)
+def call_gemini_letter_template(codes, officer, lang):
+    if client is None:
+        return None, "Gemini client not configured"
+    try:
+        resp = client.models.generate_content(model="gemini-2.5-flash", contents=[letter_template_prompt(codes, officer, lang)])
+        tracing.record_tokens("gemini.letter_template", resp)
+        text = re.sub(r'[\u200b-\u200f\u202a-\u202e]', '', getattr(resp, "text", None) or "").strip()
+        missing = [f for f in TEMPLATE_REQUIRED if f not in text]
+        if missing:
+            return None, "Letter template is missing placeholders: " + ", ".join(missing)
+        return text, None
+    except Exception as e:
+        return None, str(e)
+
+def fill_letter_template(template, bill, mistakes, mobile, app_date, extra_context):
+    points = "\n".join(["- " + (m.get("Description_Hindi") or m.get("description") or "") for m in mistakes]) if mistakes else ""
+    values = {
+        "[[CONSUMER_NAME]]": str(bill.get("Consumer_Name") or "N/A"),
+        "[[CONSUMER_ID]]": str(bill.get("Consumer_ID") or "N/A"),
+        "[[DISCOM]]": str(bill.get("Discom_Name") or ""),
+        "[[DATE]]": str(app_date or ""),
+        "[[MOBILE]]": str(mobile or ""),
+        "[[MISTAKES]]": points,
+        "[[CONTEXT]]": (extra_context or "").strip(),
+    }
+    # Single pass so a consumer value that happens to contain a placeholder is never substituted again
+    text = re.sub(r"\[\[[A-Z_]+\]\]", lambda m: values.get(m.group(0), m.group(0)), template)
+    return re.sub(r"\n{3,}", "\n\n", text).strip()
+
+def template_letter(bill, selected_mistakes, extra_context, officer, lang, mobile, app_date):
+    key = letter_template_key(selected_mistakes, officer, lang)
+    template = cached_letter(key)
+    if template is None:
+        template, err = call_gemini_letter_template(mistake_codes(selected_mistakes), officer, lang)
+        if template is None:
+            return None, err
+        store_letter(key, template)
+    return fill_letter_template(template, bill, selected_mistakes, mobile, app_date, extra_context), None
+
+def letter_cache_stats():
+    return letter_cache.stats() if letter_cache is not None else None
+
+DOC_CACHE_SIZE = int(os.environ.get("EBILLX_DOC_CACHE_SIZE", 8))
+_doc_cache = OrderedDict()
+_doc_cache_lock = threading.Lock()
+
+def render_document(text, fmt):
+    # Small in-memory LRU in front of the disk blob store, so rendered documents do not accumulate in RAM
+    key = (hashlib.sha256(text.encode("utf-8")).hexdigest(), fmt)
+    with _doc_cache_lock:
+        data = _doc_cache.get(key)
+        if data is not None:
+            _doc_cache.move_to_end(key)
+            return data
+    handle = f"doc-{key[0]}.{fmt}"
+    data = blob_store.get(handle) if blob_store is not None else None
+    if data is None:
+        data = (create_pdf_buffer(text) if fmt == "pdf" else create_docx_buffer(text)).getvalue()
+        if blob_store is not None:
+            blob_store.put(data, handle)
+    with _doc_cache_lock:
+        _doc_cache[key] = data
+        while len(_doc_cache) > DOC_CACHE_SIZE:
+            _doc_cache.popitem(last=False)
+    return data
+
+def pretty_json(v):
+    try:
+        return json.dumps(v, ensure_ascii=False, indent=2)
+    except:
+        return str(v)
+
+def calculate(extracted, extra_context=""):
+    with span("tariff.local"):
+        calc_res = calculate_locally(extracted, tariff_store)
+    if calc_res is not None:
+        return calc_res, None, "local tariff table"
+    calc_res, calc_err = call_gemini_calculate_and_explain(extracted, extra_context)
+    return calc_res, calc_err, "Gemini"
+
+@traced("analysis.history")
+def history_mistakes(extracted):
+    if history_store is None:
+        return []
+    try:
+        return history_store.record_and_check(extracted)
+    except Exception as e:
+        log.warning("history check failed: %s", e)
+        return []
+
+@traced("analysis.mistakes")
+def detect_mistakes(extracted, calc_res):
+    mistakes = []
+    provided = parse_number(extracted.get("Total_Amount_Payable_INR"))
+    calc_total = parse_number((calc_res.get("calculation") or {}).get("total"))
+    if calc_total is not None and provided is not None:
+        diff = abs(calc_total - provided)
+        pct = (diff / provided * 100) if provided else 0
+        if pct > 3:
+            mistakes.append({"Mistake_Code":"CALC_ERR", "Description_Hindi": f"बिल गणना में अंतर: अपेक्षित ₹{calc_total} जबकि बिल में ₹{provided}. अंतर {round(pct,2)}%."})
+    if is_missing(extracted.get("Sanctioned_Load_kW")):
+        mistakes.append({"Mistake_Code":"MISSING_DATA", "Description_Hindi":"Sanctioned Load गायब है।"})
+    sload = parse_number(extracted.get("Sanctioned_Load_kW"))
+    units = parse_number(extracted.get("Units_Consumed_kWh"))
+    if sload and units and units / sload > 200:
+        mistakes.append({"Mistake_Code":"HIGH_USE", "Description_Hindi":f"प्रति kW {round(units/sload,1)} यूनिट — असामान्य खपत।"})
+    return mistakes
+
+ANALYSIS_MODES = ("two-call", "fused", "ab")
+BILL_FIELDS = ["Consumer_ID", "Consumer_Name", "Sanctioned_Load_kW", "Units_Consumed_kWh", "Billing_Date",
+               "Total_Amount_Payable_INR", "Discom_Name", "Division", "Tariff_Category", "Reading_Type", "Raw_Bill_Text"]
+FUSED_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "extracted": {"type": "OBJECT", "properties": {k: {"type": "STRING"} for k in BILL_FIELDS}, "required": BILL_FIELDS},
+        "calculation": {
+            "type": "OBJECT",
+            "properties": {
+                "discom": {"type": "STRING"},
+                "division": {"type": "STRING"},
+                "tariff_category": {"type": "STRING"},
+                "fixed_per_kw": {"type": "NUMBER"},
+                "slabs": {"type": "ARRAY", "items": {"type": "OBJECT", "properties": {"range": {"type": "STRING"}, "rate": {"type": "NUMBER"}}}},
+                "duty": {"type": "NUMBER"},
+                "calculation": {
+                    "type": "OBJECT",
+                    "properties": {
+                        "fixed": {"type": "NUMBER"},
+                        "energy_details": {"type": "ARRAY", "items": {"type": "OBJECT", "properties": {
+                            "slab": {"type": "STRING"}, "units": {"type": "NUMBER"}, "rate": {"type": "NUMBER"}, "amount": {"type": "NUMBER"}}}},
+                        "energy_total": {"type": "NUMBER"},
+                        "duty": {"type": "NUMBER"},
+                        "total": {"type": "NUMBER"},
+                    },
+                    "required": ["fixed", "energy_details", "energy_total", "duty", "total"],
+                },
+                "bill_correct": {"type": "BOOLEAN"},
+                "difference": {"type": "NUMBER"},
+            },
+            "required": ["calculation"],
+        },
+    },
+    "required": ["extracted", "calculation"],
+}
+
+_analysis_stats = {m: {"runs": 0, "failures": 0, "parse_failures": 0, "latency_s": 0.0} for m in ANALYSIS_MODES[:2]}
+_analysis_stats_lock = threading.Lock()
+
+def record_analysis(mode, latency_s, error=None):
+    with _analysis_stats_lock:
+        entry = _analysis_stats.setdefault(mode, {"runs": 0, "failures": 0, "parse_failures": 0, "latency_s": 0.0})
+        entry["runs"] += 1
+        entry["latency_s"] += latency_s
+        if error:
+            entry["failures"] += 1
+            if "unparsable" in error:
+                entry["parse_failures"] += 1
+
+def analysis_stats():
+    with _analysis_stats_lock:
+        return {m: {"runs": v["runs"], "failures": v["failures"], "parse_failures": v["parse_failures"],
+                    "mean_latency_s": round(v["latency_s"] / v["runs"], 3) if v["runs"] else None}
+                for m, v in _analysis_stats.items()}
+
+@traced("gemini.fused", returns_error=True)
+def call_gemini_extract_and_calculate(image_file, extra_context=""):
+    if client is None:
+        return None, None, "Gemini client not configured"
+    data = image_file.getvalue() if hasattr(image_file, "getvalue") else image_file.read()
+    try:
+        prompt = (
+            "You are an expert electricity bill extractor and billing expert. From the provided bill image, fill 'extracted' with "
+            + ", ".join(BILL_FIELDS) + " (use 'N/A' for missing values). Then identify the discom, division, tariff category, fixed charge per kW, "
+            "slab structure (range and rate) and duty percentage, calculate slab-wise energy charges, fixed charges, duty and the final total, "
+            "and compare it with Total_Amount_Payable_INR to fill 'calculation'. Context: " + extra_context
+        )
+        config = genai_types().GenerateContentConfig(response_mime_type="application/json", response_schema=FUSED_SCHEMA)
+        resp = client.models.generate_content(model="gemini-2.5-flash", contents=[prompt, image_part(data)], config=config)
+        tracing.record_tokens("gemini.fused", resp)
+        text = getattr(resp, "text", None) or ""
+        parsed = extract_json(text)
+        if not isinstance(parsed, dict):
+            return None, None, "Gemini fused response was unparsable"
+        extracted, _ = coerce_bill(parsed.get("extracted"))
+        calc_res, _ = coerce_calculation(parsed.get("calculation"))
+        if extracted is None or calc_res is None:
+            return None, None, "Gemini fused response was unparsable"
+        if extract_cache is not None:
+            try:
+                extract_cache.put(extract_cache_key(data, extra_context), extracted)
+            except Exception:
+                pass
+        return extracted, calc_res, None
+    except Exception as e:
+        return None, None, str(e)
+
+def resolve_mode(mode=None):
+    mode = mode or os.environ.get("EBILLX_ANALYSIS_MODE", "two-call")
+    if mode == "ab":
+        mode = random.choice(ANALYSIS_MODES[:2])
+    return mode if mode in ANALYSIS_MODES[:2] else "two-call"
+
+@traced("analysis.total")
+def analyze_bill(image_file, extra_context="", mode=None):
+    mode = resolve_mode(mode)
+    start = time.perf_counter()
+    result = _analyze_fused(image_file, extra_context) if mode == "fused" else _analyze_two_call(image_file, extra_context)
+    result["mode"] = mode
+    # Runs whose extraction came from the cache skip the mode's own model call; keep them out of the A/B numbers
+    record_analysis("cached" if result["extract_cached"] else mode, time.perf_counter() - start, result["error"])
+    return result
+
+def analyze_bytes(data, extra_context="", mode=None):
+    return analyze_bill(io.BytesIO(data), extra_context, mode)
+
+def job_input_key(data, extra_context="", mode=None):
+    return extract_cache_key(data, extra_context) + "|" + str(mode or "")
+
+def _new_result():
+    return {"extracted": None, "calculation": None, "calc_source": None, "mistakes": None, "error": None, "extract_cached": False}
+
+def _calculate_into(result, extracted, extra_context):
+    result["extracted"] = extracted
+    calc_res, calc_err, source = calculate(extracted, extra_context)
+    if calc_res is None:
+        result["error"] = "Calculation by Gemini failed: " + str(calc_err)
+        return result
+    result["calculation"] = calc_res
+    result["calc_source"] = source
+    result["mistakes"] = detect_mistakes(extracted, calc_res) + history_mistakes(extracted)
+    return result
+
+def _analyze_fused(image_file, extra_context=""):
+    result = _new_result()
+    data = image_file.getvalue() if hasattr(image_file, "getvalue") else image_file.read()
+    _, cached = lookup_extract(data, extra_context)
+    if cached is not None:
+        # Extraction already cached: only the calculation is left
+        result["extract_cached"] = True
+        return _calculate_into(result, cached, extra_context)
+    extracted, calc_res, err = call_gemini_extract_and_calculate(io.BytesIO(data), extra_context)
+    if extracted is None:
+        result["error"] = "Extraction failed: " + str(err)
+        return result
+    result["extracted"] = extracted
+    local = calculate_locally(extracted, tariff_store)
+    result["calculation"] = local if local is not None else calc_res
+    result["calc_source"] = "local tariff table" if local is not None else "Gemini (fused)"
+    result["mistakes"] = detect_mistakes(extracted, result["calculation"]) + history_mistakes(extracted)
+    return result
+
+def _analyze_two_call(image_file, extra_context=""):
+    result = _new_result()
+    data = image_file.getvalue() if hasattr(image_file, "getvalue") else image_file.read()
+    cache_key, cached = lookup_extract(data, extra_context)
+    if cached is not None:
+        result["extract_cached"] = True
+        return _calculate_into(result, cached, extra_context)
+    extracted, err = call_gemini_extract(io.BytesIO(data), extra_context, cache_key)
+    if extracted is None:
+        result["error"] = "Extraction failed: " + str(err)
+        return result
+    return _calculate_into(result, extracted, extra_context)
@@ -0,0 +1,121 @@
+import os, io, re
+from xml.sax.saxutils import escape
+from tracing import traced
+# fpdf and docx are imported on first use; this module is also imported by export worker processes
+
+FONT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "NotoSans-Regular.ttf")
+FONT_AVAILABLE = os.path.exists(FONT_PATH)
+_char_widths = {}
+
+def wrap_line(line, max_width, char_width):
+    # Greedy word wrap in a single pass over the line using per-character widths
+    lines = []
+    start = 0
+    width = 0.0
+    space_at = -1
+    width_at_space = 0.0
+    for i, ch in enumerate(line):
+        cw = char_width(ch)
+        if ch == " " and width + cw > max_width and i > start:
+            lines.append(line[start:i])
+            start = i + 1
+            width = 0.0
+            space_at = -1
+            continue
+        while width + cw > max_width and i > start:
+            if space_at > start:
+                lines.append(line[start:space_at])
+                width -= width_at_space + char_width(" ")
+                start = space_at + 1
+            else:
+                lines.append(line[start:i])
+                width = 0.0
+                start = i
+            space_at = -1
+        if ch == " ":
+            space_at = i
+            width_at_space = width
+        width += cw
+    lines.append(line[start:])
+    return lines
+
+def new_pdf():
+    from fpdf import FPDF
+    pdf = FPDF(format='A4')
+    pdf.set_left_margin(12)
+    pdf.set_right_margin(12)
+    family = "Helvetica"
+    if FONT_AVAILABLE:
+        try:
+            pdf.add_font("NotoSans", "", FONT_PATH)
+            family = "NotoSans"
+        except Exception:
+            family = "Helvetica"
+    pdf.set_font(family, size=11)
+    return pdf
+
+def add_letter(pdf, text):
+    # Writes one letter starting on a new page; several letters can share one document
+    text = re.sub(r'[\u200b-\u200f\u202a-\u202e]', '', text)
+    family = pdf.font_family
+    if family == "helvetica":
+        text = text.encode("latin-1", "replace").decode("latin-1")
+
+    widths = _char_widths.setdefault(family, {})
+    def char_width(ch):
+        w = widths.get(ch)
+        if w is None:
+            w = widths[ch] = pdf.get_string_width(ch)
+        return w
+
+    pdf.add_page()
+    max_width = pdf.w - 24
+
+    for para in text.split("\n"):
+        line = para.strip()
+        if line == "":
+            pdf.ln(6)
+            continue
+        for part in wrap_line(line, max_width, char_width):
+            pdf.cell(max_width, 6, part, new_x="LMARGIN", new_y="NEXT")
+
+@traced("render.pdf")
+def create_pdf_buffer(text):
+    pdf = new_pdf()
+    add_letter(pdf, text)
+    buf = io.BytesIO(bytes(pdf.output()))
+    buf.seek(0)
+    return buf
+
+@traced("render.docx")
+def create_docx_buffer(text):
+    from docx import Document
+    doc = Document()
+    for line in text.split("\n"):
+        doc.add_paragraph(line)
+    buf = io.BytesIO()
+    doc.save(buf)
+    buf.seek(0)
+    return buf
+
+_XML_INVALID = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+DOCX_PAGE_BREAK = '<w:p><w:r><w:br w:type="page"/></w:r></w:p>'
+
+def docx_paragraphs_xml(text):
+    # Same paragraphs create_docx_buffer would add, as raw WordprocessingML for streamed multi-letter documents
+    parts = []
+    for line in _XML_INVALID.sub("", text).split("\n"):
+        parts.append(f'<w:p><w:r><w:t xml:space="preserve">{escape(line)}</w:t></w:r></w:p>' if line else "<w:p/>")
+    return "".join(parts)
+
+def docx_skeleton():
+    # (entries, head, tail): every part of an empty python-docx document, with word/document.xml split around the body
+    import zipfile
+    from docx import Document
+    buf = io.BytesIO()
+    Document().save(buf)
+    with zipfile.ZipFile(buf) as zf:
+        entries = [(info, zf.read(info)) for info in zf.infolist() if info.filename != "word/document.xml"]
+        xml = zf.read("word/document.xml").decode("utf-8")
+    cut = xml.index("<w:body>") + len("<w:body>")
+    return entries, xml[:cut], xml[cut:]
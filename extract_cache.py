@@ -0,0 +1,95 @@
+import os, io, json, time, sqlite3, hashlib, threading
+from PIL import Image, ImageOps
+
+CACHE_DIR = os.environ.get("EBILLX_CACHE_DIR", ".ebillx_cache")
+
+def image_digest(data):
+    # Hash decoded pixels (orientation applied) so re-saved copies of the same photo share a key
+    try:
+        img = ImageOps.exif_transpose(Image.open(io.BytesIO(data))).convert("RGB")
+        h = hashlib.sha256(f"{img.width}x{img.height}:".encode())
+        h.update(img.tobytes())
+        return h.hexdigest()
+    except Exception:
+        return hashlib.sha256(data).hexdigest()
+
+def make_key(data, prompt_version, extra_context=""):
+    h = hashlib.sha256()
+    for part in (image_digest(data), prompt_version, extra_context or ""):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+class ExtractCache:
+    def __init__(self, path=None, ttl_seconds=30 * 24 * 3600, max_entries=5000, table="extract_cache"):
+        self.path = path or os.path.join(CACHE_DIR, "extract.sqlite3")
+        self.table = table
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        d = os.path.dirname(self.path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_accessed ON {table}(accessed)")
+        self._conn.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(f"SELECT value, created FROM {self.table} WHERE key=?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            if self.ttl_seconds and now - row[1] > self.ttl_seconds:
+                self._conn.execute(f"DELETE FROM {self.table} WHERE key=?", (key,))
+                self._conn.commit()
+                self.evictions += 1
+                self.misses += 1
+                return None
+            self._conn.execute(f"UPDATE {self.table} SET accessed=? WHERE key=?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        if self.ttl_seconds:
+            cur = self._conn.execute(f"DELETE FROM {self.table} WHERE created < ?", (now - self.ttl_seconds,))
+            self.evictions += max(cur.rowcount, 0)
+        if self.max_entries:
+            count = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+            if count > self.max_entries:
+                cur = self._conn.execute(
+                    f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} ORDER BY accessed ASC LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+                self.evictions += max(cur.rowcount, 0)
+
+    def stats(self):
+        with self._lock:
+            size = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "entries": size,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0}
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table}")
+            self._conn.commit()
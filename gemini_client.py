@@ -0,0 +1,218 @@
+import os, time, random, logging, threading
+import tracing
+from tracing import span
+
+log = logging.getLogger("ebillx.gemini")
+
+RETRYABLE_CODES = {408, 429, 500, 502, 503, 504}
+RETRYABLE_TEXT = ("resource_exhausted", "unavailable", "deadline", "timed out", "timeout", "overloaded", "rate limit", "connection")
+
+class CircuitOpenError(Exception):
+    pass
+
+class GeminiTimeoutError(Exception):
+    pass
+
+def is_retryable(exc):
+    code = getattr(exc, "code", None) or getattr(exc, "status_code", None)
+    if isinstance(code, int):
+        return code in RETRYABLE_CODES
+    if isinstance(exc, (TimeoutError, ConnectionError, GeminiTimeoutError)):
+        return True
+    name = type(exc).__name__.lower()
+    if "timeout" in name or "connect" in name:
+        return True
+    text = str(exc).lower()
+    return any(c in text for c in ("429", "500", "502", "503", "504")) or any(t in text for t in RETRYABLE_TEXT)
+
+class CircuitBreaker:
+    def __init__(self, threshold=5, cooldown_s=30.0):
+        self.threshold = threshold
+        self.cooldown_s = cooldown_s
+        self.failures = 0
+        self.opened_at = None
+        self.trips = 0
+        self._probe = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown_s:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        with self._lock:
+            st = self._state()
+            if st == "closed":
+                return True
+            if st == "half-open" and not self._probe:
+                # Let a single probe request through; everything else keeps failing fast until it reports back
+                self._probe = True
+                return True
+            return False
+
+    def release(self):
+        # The caller gave up before reaching the API: free the probe slot without a verdict either way
+        with self._lock:
+            self._probe = False
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probe = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probe or self.failures >= self.threshold:
+                if self.opened_at is None or self._probe:
+                    self.trips += 1
+                    log.warning("Gemini circuit opened after %d failures", self.failures)
+                self.opened_at = time.monotonic()
+                self._probe = False
+
+class _Models:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def generate_content(self, **kwargs):
+        return self._owner.call("generate_content", kwargs)
+
+    def generate_content_stream(self, **kwargs):
+        return self._owner.stream(kwargs)
+
+class ResilientClient:
+    # Drop-in for genai.Client(): one shared underlying client (created lazily, so one HTTP connection pool per
+    # process), per-call timeouts, an overall deadline across jittered exponential retries, a concurrency cap
+    # and a circuit breaker that makes callers fail fast (and use their local fallbacks) while the API is degraded.
+    def __init__(self, api_key=None, client=None, timeout_s=None, deadline_s=None, retries=None, concurrency=None,
+                 breaker_threshold=None, breaker_cooldown_s=None, base_delay_s=0.5, max_delay_s=8.0):
+        env = os.environ.get
+        self._api_key = api_key
+        self._client = client
+        self.timeout_s = float(env("EBILLX_GEMINI_TIMEOUT_S", 60)) if timeout_s is None else timeout_s
+        self.deadline_s = float(env("EBILLX_GEMINI_DEADLINE_S", 120)) if deadline_s is None else deadline_s
+        self.retries = int(env("EBILLX_GEMINI_RETRIES", 3)) if retries is None else retries
+        self.concurrency = int(env("EBILLX_GEMINI_CONCURRENCY", 8)) if concurrency is None else concurrency
+        self.base_delay_s = base_delay_s
+        self.max_delay_s = max_delay_s
+        self.breaker = CircuitBreaker(
+            int(env("EBILLX_BREAKER_THRESHOLD", 5)) if breaker_threshold is None else breaker_threshold,
+            float(env("EBILLX_BREAKER_COOLDOWN_S", 30)) if breaker_cooldown_s is None else breaker_cooldown_s)
+        self._sem = threading.BoundedSemaphore(max(1, self.concurrency))
+        self._init_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.models = _Models(self)
+        self.counters = {"calls": 0, "retries": 0, "failures": 0, "rejected": 0, "timeouts": 0}
+
+    @property
+    def raw(self):
+        if self._client is None:
+            with self._init_lock:
+                if self._client is None:
+                    with span("gemini.client_init"):
+                        from google import genai
+                        from google.genai import types
+                        self._client = genai.Client(api_key=self._api_key,
+                                                    http_options=types.HttpOptions(timeout=int(self.timeout_s * 1000)))
+        return self._client
+
+    def degraded(self):
+        return self.breaker.state != "closed"
+
+    def stats(self):
+        with self._stats_lock:
+            counters = dict(self.counters)
+        return {**counters, "breaker": self.breaker.state, "trips": self.breaker.trips, "concurrency": self.concurrency}
+
+    def _count(self, key, n=1):
+        with self._stats_lock:
+            self.counters[key] += n
+
+    def _backoff(self, attempt, remaining):
+        delay = min(self.max_delay_s, self.base_delay_s * (2 ** attempt)) * random.uniform(0.5, 1.0)
+        if delay >= remaining:
+            return False
+        time.sleep(delay)
+        return True
+
+    def _acquire(self, deadline):
+        if not self.breaker.allow():
+            self._count("rejected")
+            raise CircuitOpenError("Gemini circuit breaker open; using local fallback where possible")
+        if not self._sem.acquire(timeout=max(0.0, deadline - time.monotonic())):
+            # A local queueing timeout says nothing about the API's health, so it must not trip the breaker
+            self._count("timeouts")
+            self.breaker.release()
+            raise GeminiTimeoutError("Timed out waiting for a free Gemini slot")
+
+    def _run(self, fn, deadline):
+        # Every attempt re-checks the breaker and semaphore; a non-retryable error (e.g. 400) does not count against the API
+        attempt = 0
+        while True:
+            self._acquire(deadline)
+            try:
+                result = fn()
+            except Exception as e:
+                retryable = is_retryable(e)
+                if retryable:
+                    self.breaker.failure()
+                else:
+                    self.breaker.success()
+                self._sem.release()
+                remaining = deadline - time.monotonic()
+                if not retryable or attempt >= self.retries or remaining <= 0 or not self._backoff(attempt, remaining):
+                    self._count("failures")
+                    raise
+                attempt += 1
+                self._count("retries")
+                tracing.record("gemini.retry", 0.0, error=e)
+                continue
+            return result
+
+    def call(self, method, kwargs):
+        self._count("calls")
+        deadline = time.monotonic() + self.deadline_s
+
+        def attempt():
+            return getattr(self.raw.models, method)(**kwargs)
+
+        result = self._run(attempt, deadline)
+        self.breaker.success()
+        self._sem.release()
+        return result
+
+    def stream(self, kwargs):
+        # Retries only cover opening the stream (up to the first chunk); once text has been shown a failure propagates
+        self._count("calls")
+        deadline = time.monotonic() + self.deadline_s
+
+        def open_stream():
+            it = iter(self.raw.models.generate_content_stream(**kwargs))
+            return it, next(it, None)
+
+        it, first = self._run(open_stream, deadline)
+        try:
+            if first is not None:
+                yield first
+            for chunk in it:
+                yield chunk
+            self.breaker.success()
+        except Exception as e:
+            if is_retryable(e):
+                self.breaker.failure()
+            self._count("failures")
+            raise
+        finally:
+            self._sem.release()
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
@@ -0,0 +1,162 @@
+import os, sys, sqlite3, argparse, threading
+from datetime import date
+from tariffs import to_number, parse_date, norm_key
+
+HISTORY_FILE = os.path.join(os.environ.get("EBILLX_CACHE_DIR", ".ebillx_cache"), "history.sqlite3")
+WINDOW = 12
+MIN_BASELINE = 3
+SPIKE_RATIO = 1.5
+SPIKE_Z = 2.0
+ESTIMATED_STREAK = 3
+TARIFF_CHANGES = 2
+ESTIMATED_MARKERS = ("estim", "provision", "average", "avg", "idf", "adf", "rdf", "assess", "अनुमान", "औसत")
+
+def is_estimated(reading_type):
+    r = str(reading_type or "").casefold()
+    return any(m in r for m in ESTIMATED_MARKERS)
+
+class HistoryStore:
+    def __init__(self, path=HISTORY_FILE):
+        self.path = path
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # Clustered on (consumer_id, billing_date): a consumer's recent months are one short index range scan
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS bills (consumer_id TEXT NOT NULL, billing_date TEXT NOT NULL, units REAL, amount REAL, "
+            "load_kw REAL, discom TEXT, tariff_category TEXT, estimated INTEGER NOT NULL DEFAULT 0, "
+            "PRIMARY KEY (consumer_id, billing_date)) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS bills_date ON bills(billing_date)")
+        self._conn.commit()
+
+    @staticmethod
+    def row_for(bill):
+        cid = str(bill.get("Consumer_ID") or "").strip()
+        d = parse_date(bill.get("Billing_Date"))
+        if not cid or cid.upper() == "N/A" or d is None:
+            return None
+        return (cid, d.isoformat(), to_number(bill.get("Units_Consumed_kWh")), to_number(bill.get("Total_Amount_Payable_INR")),
+                to_number(bill.get("Sanctioned_Load_kW")), norm_key(bill.get("Discom_Name")), norm_key(bill.get("Tariff_Category")),
+                int(is_estimated(bill.get("Reading_Type"))))
+
+    def add(self, bill):
+        row = self.row_for(bill)
+        if row is None:
+            return None
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO bills VALUES (?, ?, ?, ?, ?, ?, ?, ?)", row)
+            self._conn.commit()
+        return row
+
+    def add_many(self, bills):
+        rows = [r for r in (self.row_for(b) for b in bills) if r is not None]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO bills VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self._conn.commit()
+        return len(rows)
+
+    def previous(self, consumer_id, before, limit=WINDOW):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT billing_date, units, tariff_category, estimated FROM bills WHERE consumer_id=? AND billing_date<? "
+                "ORDER BY billing_date DESC LIMIT ?", (consumer_id, before, limit)).fetchall()
+
+    def record_and_check(self, bill):
+        # Only the consumer's last WINDOW bills before this one are read, so cost does not grow with history length
+        row = self.add(bill)
+        if row is None:
+            return []
+        cid, bdate, units, _, _, _, category, estimated = row
+        prev = self.previous(cid, bdate)
+        return check_against(units, category, estimated, prev)
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM bills").fetchone()[0]
+
+def check_against(units, category, estimated, prev):
+    mistakes = []
+    prev_units = [p[1] for p in prev if p[1] is not None and not p[3]]
+    if units is not None and len(prev_units) >= MIN_BASELINE:
+        mean = sum(prev_units) / len(prev_units)
+        var = sum((u - mean) ** 2 for u in prev_units) / len(prev_units)
+        std = max(var ** 0.5, 0.1 * mean, 1.0)
+        if mean > 0 and units > SPIKE_RATIO * mean and (units - mean) / std > SPIKE_Z:
+            mistakes.append({"Mistake_Code": "CONSUMPTION_SPIKE",
+                             "Description_Hindi": f"खपत {round(units)} यूनिट — पिछले {len(prev_units)} महीनों के औसत {round(mean)} यूनिट से {round(units / mean, 1)} गुना।"})
+    if estimated:
+        streak = 1
+        for p in prev:
+            if not p[3]:
+                break
+            streak += 1
+        if streak >= ESTIMATED_STREAK:
+            mistakes.append({"Mistake_Code": "ESTIMATED_STREAK",
+                             "Description_Hindi": f"लगातार {streak} बिल अनुमानित (estimated) रीडिंग पर बने हैं — वास्तविक मीटर रीडिंग नहीं ली गई।"})
+    categories = [category] + [p[2] for p in prev]
+    changes = sum(1 for a, b in zip(categories, categories[1:]) if a and b and a != b)
+    if changes >= TARIFF_CHANGES:
+        mistakes.append({"Mistake_Code": "TARIFF_CHANGE",
+                         "Description_Hindi": f"पिछले {len(categories)} बिलों में टैरिफ श्रेणी {changes} बार बदली गई है।"})
+    return mistakes
+
+def scan_anomalies(path=HISTORY_FILE, since=None, window=WINDOW):
+    # Vectorised audit over the whole store (or bills since a date plus enough lookback for the rolling baseline)
+    import pandas as pd
+    conn = sqlite3.connect(path)
+    try:
+        if since:
+            since = parse_date(since) or date.fromisoformat(str(since))
+            lookback = date(since.year - (window // 12 + 1), since.month, 1).isoformat()
+            df = pd.read_sql_query("SELECT consumer_id, billing_date, units, tariff_category, estimated FROM bills WHERE billing_date>=? "
+                                   "ORDER BY consumer_id, billing_date", conn, params=(lookback,))
+        else:
+            df = pd.read_sql_query("SELECT consumer_id, billing_date, units, tariff_category, estimated FROM bills "
+                                   "ORDER BY consumer_id, billing_date", conn)
+    finally:
+        conn.close()
+    if df.empty:
+        return df.assign(codes=pd.Series(dtype=str))
+    g = df.groupby("consumer_id", sort=False)
+    actual = df["units"].where(df["estimated"] == 0)
+    shifted = actual.groupby(df["consumer_id"]).shift(1)
+    roll = shifted.groupby(df["consumer_id"]).rolling(window, min_periods=MIN_BASELINE)
+    df["baseline"] = roll.mean().reset_index(level=0, drop=True)
+    std = roll.std(ddof=0).reset_index(level=0, drop=True)
+    std = pd.concat([std, 0.1 * df["baseline"]], axis=1).max(axis=1).clip(lower=1.0)
+    df["spike"] = (df["units"] > SPIKE_RATIO * df["baseline"]) & ((df["units"] - df["baseline"]) / std > SPIKE_Z)
+    # Estimated streaks: run length of consecutive estimated bills within each consumer
+    run_id = (df["estimated"] != g["estimated"].shift(1)).cumsum()
+    df["estimated_streak"] = df.groupby(run_id).cumcount().add(1).where(df["estimated"] == 1, 0)
+    changed = (df["tariff_category"] != g["tariff_category"].shift(1)) & g["tariff_category"].shift(1).notna() & (df["tariff_category"] != "")
+    df["tariff_changes"] = changed.astype(int).groupby(df["consumer_id"]).rolling(window, min_periods=1).sum().reset_index(level=0, drop=True)
+    codes = pd.Series("", index=df.index)
+    codes = codes.where(~df["spike"], codes + "CONSUMPTION_SPIKE;")
+    codes = codes.where(df["estimated_streak"] < ESTIMATED_STREAK, codes + "ESTIMATED_STREAK;")
+    codes = codes.where(df["tariff_changes"] < TARIFF_CHANGES, codes + "TARIFF_CHANGE;")
+    df["codes"] = codes.str.rstrip(";")
+    out = df[df["codes"] != ""]
+    if since:
+        out = out[out["billing_date"] >= since.isoformat()]
+    return out.reset_index(drop=True)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Multi-month anomaly scan over the consumer bill history")
+    ap.add_argument("--db", default=HISTORY_FILE)
+    ap.add_argument("--since", help="only report bills on/after this date (YYYY-MM-DD)")
+    ap.add_argument("-o", "--out", help="write flagged bills to CSV")
+    args = ap.parse_args(argv)
+    out = scan_anomalies(args.db, args.since)
+    if args.out:
+        out.to_csv(args.out, index=False)
+    else:
+        print(out.to_string(index=False))
+    print(f"{len(out)} flagged bills", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import os, io, time, logging
+from PIL import Image, ImageOps, ImageFilter
+
+log = logging.getLogger("ebillx.image_prep")
+
+def env_flag(name, default):
+    return os.environ.get(name, "1" if default else "0").strip().lower() in ("1", "true", "yes", "on")
+
+class PrepConfig:
+    def __init__(self, enabled=None, max_dim=None, grayscale=None, crop=None, fmt=None, quality=None):
+        self.enabled = env_flag("EBILLX_IMG_PREPROCESS", True) if enabled is None else enabled
+        self.max_dim = int(os.environ.get("EBILLX_IMG_MAX_DIM", 1600)) if max_dim is None else max_dim
+        self.grayscale = env_flag("EBILLX_IMG_GRAYSCALE", True) if grayscale is None else grayscale
+        # Off until bench/preprocess_bench.py --ablate has been run against Gemini: cropping can cut off bill edges
+        self.crop = env_flag("EBILLX_IMG_CROP", False) if crop is None else crop
+        self.fmt = (os.environ.get("EBILLX_IMG_FORMAT", "JPEG") if fmt is None else fmt).upper()
+        self.quality = int(os.environ.get("EBILLX_IMG_QUALITY", 80)) if quality is None else quality
+
+    def signature(self):
+        if not self.enabled:
+            return "raw"
+        return f"{self.max_dim}:{int(self.grayscale)}:{int(self.crop)}:{self.fmt}:{self.quality}"
+
+def find_bill_box(img, min_area=0.3, margin=0.02):
+    # Bills are light paper on a darker background: threshold a small blurred copy and take the bright bbox
+    small = img.convert("L")
+    small.thumbnail((256, 256))
+    small = ImageOps.autocontrast(small.filter(ImageFilter.GaussianBlur(2)))
+    hist = small.histogram()
+    n = sum(hist)
+    mean = sum(i * c for i, c in enumerate(hist)) / n if n else 0
+    mask = small.point(lambda p: 255 if p > mean else 0)
+    bbox = mask.getbbox()
+    if not bbox:
+        return None
+    sx, sy = img.width / small.width, img.height / small.height
+    l, t, r, b = bbox
+    if (r - l) * (b - t) < min_area * small.width * small.height:
+        return None
+    mx, my = int(img.width * margin), int(img.height * margin)
+    box = (max(0, int(l * sx) - mx), max(0, int(t * sy) - my), min(img.width, int(r * sx) + mx), min(img.height, int(b * sy) + my))
+    if box == (0, 0, img.width, img.height):
+        return None
+    return box
+
+def prepare_image(data, config=None):
+    config = config or PrepConfig()
+    start = time.perf_counter()
+    stats = {"bytes_before": len(data), "bytes_after": len(data), "size_before": None, "size_after": None, "prep_ms": 0.0}
+    img = Image.open(io.BytesIO(data))
+    stats["size_before"] = img.size
+    if not config.enabled:
+        mime = Image.MIME.get(img.format, "image/jpeg")
+        stats["size_after"] = img.size
+        return data, mime, stats
+    img = ImageOps.exif_transpose(img)
+    if config.crop:
+        box = find_bill_box(img)
+        if box:
+            img = img.crop(box)
+    img = img.convert("L") if config.grayscale else img.convert("RGB")
+    if config.max_dim and max(img.size) > config.max_dim:
+        img.thumbnail((config.max_dim, config.max_dim), Image.LANCZOS)
+    out = io.BytesIO()
+    fmt = "WEBP" if config.fmt == "WEBP" else "JPEG"
+    img.save(out, format=fmt, quality=config.quality, optimize=(fmt == "JPEG"))
+    prepared = out.getvalue()
+    if len(prepared) >= len(data) and img.size == stats["size_before"]:
+        # Re-encoding an already small image did not help; upload the original bytes
+        prepared, fmt = data, Image.open(io.BytesIO(data)).format or fmt
+    stats["bytes_after"] = len(prepared)
+    stats["size_after"] = img.size
+    stats["prep_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    log.info("prepared bill image %sx%s -> %sx%s, %d -> %d bytes in %.1f ms", *stats["size_before"], *stats["size_after"],
+             stats["bytes_before"], stats["bytes_after"], stats["prep_ms"])
+    return prepared, Image.MIME.get(fmt, "image/jpeg"), stats
@@ -0,0 +1,146 @@
+import os, json, time, uuid, sqlite3, logging, threading
+from extract_cache import CACHE_DIR
+
+log = logging.getLogger("ebillx.jobs")
+
+JOB_FILE = os.path.join(CACHE_DIR, "jobs.sqlite3")
+FINAL = ("done", "failed")
+
+class JobQueue:
+    # Durable analysis queue: jobs and results live in SQLite, uploads as files beside it, and a small pool of daemon
+    # threads works through them. Script threads only submit and poll, so they never block on Gemini.
+    def __init__(self, handler, path=JOB_FILE, workers=None, ttl_seconds=None, stale_seconds=None, poll_s=0.5):
+        env = os.environ.get
+        self.handler = handler
+        self.path = path
+        self.workers = int(env("EBILLX_JOB_WORKERS", 4)) if workers is None else workers
+        self.ttl_seconds = int(env("EBILLX_JOB_TTL", 7 * 24 * 3600)) if ttl_seconds is None else ttl_seconds
+        self.stale_seconds = int(env("EBILLX_JOB_STALE_S", 600)) if stale_seconds is None else stale_seconds
+        self.poll_s = poll_s
+        self.blob_dir = os.path.join(os.path.dirname(path) or ".", "jobs")
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, input_key TEXT, status TEXT NOT NULL, extra_context TEXT, mode TEXT, "
+            "result TEXT, error TEXT, created REAL NOT NULL, started REAL, finished REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, created)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_input ON jobs(input_key)")
+        self._conn.commit()
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return self
+            for i in range(max(1, self.workers)):
+                t = threading.Thread(target=self._work, name=f"ebillx-job-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _blob(self, job_id):
+        return os.path.join(self.blob_dir, job_id + ".bin")
+
+    def submit(self, data, extra_context="", mode=None, input_key=None):
+        # Identical input (same key) reuses the queued, running or finished job instead of re-running the analysis
+        now = time.time()
+        with self._lock:
+            if input_key:
+                row = self._conn.execute(
+                    "SELECT id FROM jobs WHERE input_key=? AND status!='failed' AND created>=? ORDER BY created DESC LIMIT 1",
+                    (input_key, now - self.ttl_seconds)).fetchone()
+                if row:
+                    return row[0]
+            job_id = uuid.uuid4().hex
+            with open(self._blob(job_id), "wb") as f:
+                f.write(data)
+            self._conn.execute("INSERT INTO jobs (id, input_key, status, extra_context, mode, created) VALUES (?, ?, 'queued', ?, ?, ?)",
+                               (job_id, input_key, extra_context or "", mode, now))
+            self._purge(now)
+            self._conn.commit()
+        self._wake.set()
+        return job_id
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT id, status, result, error, created, started, finished FROM jobs WHERE id=?", (job_id,)).fetchone()
+            position = None
+            if row is not None and row[1] == "queued":
+                position = self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status='queued' AND created<?", (row[4],)).fetchone()[0]
+        if row is None:
+            return None
+        return {"id": row[0], "status": row[1], "result": json.loads(row[2]) if row[2] else None, "error": row[3],
+                "created": row[4], "started": row[5], "finished": row[6], "queue_position": position}
+
+    def _claim(self):
+        now = time.time()
+        stale = now - self.stale_seconds
+        with self._lock:
+            # Jobs left "running" by a crashed or restarted process are picked up again once stale
+            row = self._conn.execute(
+                "SELECT id, extra_context, mode FROM jobs WHERE status='queued' OR (status='running' AND started<?) "
+                "ORDER BY created LIMIT 1", (stale,)).fetchone()
+            if row is None:
+                return None
+            # Conditional update so two processes sharing the file never both claim the same job
+            cur = self._conn.execute("UPDATE jobs SET status='running', started=? WHERE id=? AND (status='queued' OR (status='running' AND started<?))",
+                                     (now, row[0], stale))
+            self._conn.commit()
+        return row if cur.rowcount == 1 else None
+
+    def _finish(self, job_id, result, error):
+        # A result with an error is kept for display but marked failed, so resubmitting the same bill retries it
+        status = "failed" if result is None or error else "done"
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET status=?, result=?, error=?, finished=? WHERE id=?",
+                               (status, json.dumps(result, ensure_ascii=False) if result is not None else None, error, time.time(), job_id))
+            self._conn.commit()
+        try:
+            os.remove(self._blob(job_id))
+        except OSError:
+            pass
+
+    def _work(self):
+        while not self._stop.is_set():
+            try:
+                job = self._claim()
+            except sqlite3.OperationalError:
+                job = None
+            if job is None:
+                self._wake.wait(self.poll_s)
+                self._wake.clear()
+                continue
+            job_id, extra_context, mode = job
+            try:
+                with open(self._blob(job_id), "rb") as f:
+                    data = f.read()
+                result = self.handler(data, extra_context, mode)
+                self._finish(job_id, result, result.get("error") if isinstance(result, dict) else None)
+            except Exception as e:
+                log.exception("job %s failed", job_id)
+                self._finish(job_id, None, str(e))
+
+    def _purge(self, now):
+        old = [r[0] for r in self._conn.execute("SELECT id FROM jobs WHERE created<?", (now - self.ttl_seconds,))]
+        for job_id in old:
+            try:
+                os.remove(self._blob(job_id))
+            except OSError:
+                pass
+        if old:
+            self._conn.executemany("DELETE FROM jobs WHERE id=?", [(j,) for j in old])
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return {"workers": len(self._threads), **{s: counts.get(s, 0) for s in ("queued", "running", "done", "failed")}}
@@ -0,0 +1,277 @@
+import os, io, re, sys, json, time, shutil, zipfile, argparse, tempfile
+from collections import deque
+from datetime import date
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import documents
+
+FORMATS = ("pdf", "docx", "zip")
+CHUNK_SIZE = int(os.environ.get("EBILLX_EXPORT_CHUNK", 100))
+
+def iter_records(paths):
+    # Batch results as written by batch.py (JSONL); bills without an extraction are skipped
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    rec = json.loads(line)
+                    if rec.get("extracted"):
+                        yield rec
+
+def iter_letters(records, officer="EXECUTIVE ENGINEER", lang="English", mobile="", app_date="", extra_context="", templates=False):
+    # Yields (consumer_id, text). Letters already present on a record are used as-is; otherwise the local letter,
+    # or with templates=True one cached model template per (mistake codes, officer, language), filled in locally.
+    import core  # not at module level: spawned render workers import this module and must stay light
+    for rec in records:
+        bill = rec["extracted"]
+        mistakes = rec.get("mistakes") or []
+        text = rec.get("letter")
+        if not text and templates:
+            text, _ = core.template_letter(bill, mistakes, extra_context, officer, lang, mobile, app_date)
+        if not text:
+            text = core.generate_local_simple_letter(bill, mistakes, officer, lang, mobile, app_date, extra_context)
+        yield str(bill.get("Consumer_ID") or "N-A"), text
+
+def _chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _ordered(pool, fn, chunks, workers, *args):
+    # Keeps at most 2x workers chunks in flight and yields results in input order, so memory stays flat
+    pending = deque()
+    for chunk in chunks:
+        pending.append(pool.submit(fn, chunk, *args))
+        if len(pending) >= workers * 2:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def _render_chunk(chunk):
+    # One document per chunk: the font is parsed and subset once instead of once per letter
+    pdf = documents.new_pdf()
+    ranges = []
+    for _, text in chunk:
+        first = pdf.page
+        documents.add_letter(pdf, text)
+        ranges.append((first, pdf.page))
+    return bytes(pdf.output()), ranges
+
+def _pdf_part(job, part_dir):
+    i, chunk = job
+    data, _ = _render_chunk(chunk)
+    part_path = os.path.join(part_dir, f"{i:06d}.pdf")
+    with open(part_path, "wb") as f:
+        f.write(data)
+    return part_path, len(chunk)
+
+def _docx_part(chunk):
+    return documents.DOCX_PAGE_BREAK.join(documents.docx_paragraphs_xml(text) for _, text in chunk), len(chunk)
+
+def _files_part(chunk, fmt):
+    if fmt == "pdf":
+        from pypdf import PdfReader, PdfWriter
+        # Splitting the chunk document page-wise is several times faster than rendering each letter on its own
+        data, ranges = _render_chunk(chunk)
+        reader = PdfReader(io.BytesIO(data))
+        files = []
+        for (cid, _), (first, last) in zip(chunk, ranges):
+            writer = PdfWriter()
+            for page in range(first, last):
+                writer.add_page(reader.pages[page])
+            buf = io.BytesIO()
+            writer.write(buf)
+            files.append((cid, buf.getvalue()))
+        return files
+    return [(cid, documents.create_docx_buffer(text).getvalue()) for cid, text in chunk]
+
+class PdfConcat:
+    # Appends finished PDF files to one output PDF, writing each part's pages and objects straight to the file.
+    # Only the new object numbers' xref offsets and the page list stay in memory (a few ints per letter).
+    INHERITED = ("/Resources", "/MediaBox", "/CropBox", "/Rotate")
+
+    def __init__(self, f):
+        self.f = f
+        self.offsets = [None, None, None]  # 0 is the free entry, 1 is the page tree, 2 the catalog
+        self.kids = []
+        f.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+
+    def append(self, path):
+        from pypdf import PdfReader
+        reader = PdfReader(path)
+        ids = {}
+        queue = deque()
+
+        def remap(ref):
+            key = (ref.idnum, ref.generation)
+            if key not in ids:
+                ids[key] = len(self.offsets)
+                self.offsets.append(None)
+                queue.append(ref)
+            return ids[key]
+
+        pages = set()
+        for page in reader.pages:
+            self.kids.append(remap(page.indirect_reference))
+            pages.add((page.indirect_reference.idnum, page.indirect_reference.generation))
+        while queue:
+            ref = queue.popleft()
+            obj = ref.get_object()
+            if (ref.idnum, ref.generation) in pages:
+                obj = self._page(obj)
+            num = ids[(ref.idnum, ref.generation)]
+            self.offsets[num] = self.f.tell()
+            self.f.write(b"%d 0 obj\n" % num)
+            self._emit(obj, remap)
+            self.f.write(b"\nendobj\n")
+
+    def _page(self, page):
+        # The part's page tree is not copied, so attributes a page inherits from it are copied onto the page
+        d = {k: v for k, v in dict.items(page) if k != "/Parent"}
+        for attr in self.INHERITED:
+            node = page
+            while attr not in d and "/Parent" in node:
+                node = dict.get(node, "/Parent").get_object()
+                if attr in node:
+                    d[attr] = dict.get(node, attr)
+        d["/Parent"] = b"1 0 R"
+        return d
+
+    def _emit(self, obj, remap):
+        from pypdf.generic import IndirectObject, StreamObject, ArrayObject, NameObject
+        f = self.f
+        if isinstance(obj, bytes):
+            f.write(obj)
+        elif isinstance(obj, IndirectObject):
+            f.write(b"%d 0 R" % remap(obj))
+        elif isinstance(obj, dict):
+            f.write(b"<<")
+            for k, v in dict.items(obj):
+                if k == "/Length" and isinstance(obj, StreamObject):
+                    continue
+                f.write(b"\n")
+                NameObject(k).write_to_stream(f)
+                f.write(b" ")
+                self._emit(v, remap)
+            if isinstance(obj, StreamObject):
+                f.write(b"\n/Length %d\n>>\nstream\n" % len(obj._data))
+                f.write(obj._data)
+                f.write(b"\nendstream")
+            else:
+                f.write(b"\n>>")
+        elif isinstance(obj, ArrayObject):
+            f.write(b"[")
+            for i, v in enumerate(list.__iter__(obj)):
+                if i:
+                    f.write(b" ")
+                self._emit(v, remap)
+            f.write(b"]")
+        else:
+            obj.write_to_stream(f)
+
+    def close(self):
+        f = self.f
+        self.offsets[1] = f.tell()
+        f.write(b"1 0 obj\n<< /Type /Pages /Count %d /Kids [" % len(self.kids))
+        f.write(b" ".join(b"%d 0 R" % k for k in self.kids))
+        f.write(b"] >>\nendobj\n")
+        self.offsets[2] = f.tell()
+        f.write(b"2 0 obj\n<< /Type /Catalog /Pages 1 0 R >>\nendobj\n")
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % len(self.offsets))
+        f.write(b"".join(b"%010d 00000 n \n" % o for o in self.offsets[1:]))
+        f.write(b"trailer\n<< /Size %d /Root 2 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(self.offsets), xref))
+
+def safe_name(consumer_id):
+    return re.sub(r"[^\w.-]+", "_", consumer_id).strip("._") or "N-A"
+
+def export_letters(letters, out_path, fmt="pdf", workers=None, chunk_size=CHUNK_SIZE, zip_format="pdf", on_progress=None):
+    # letters: iterable of (consumer_id, text). Chunks render in worker processes; the parent only streams the
+    # finished pieces into out_path, so a few thousand letters never sit in memory at once.
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    workers = max(1, workers or os.cpu_count() or 1)
+    chunks = _chunks(letters, max(1, chunk_size))
+    done = 0
+    tmp = out_path + ".tmp"
+    # spawn: the UI and API processes run threads, which fork does not copy safely; workers only import documents
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        if fmt == "zip":
+            seen = {}
+            with zipfile.ZipFile(tmp, "w", zipfile.ZIP_DEFLATED) as zf:
+                for files in _ordered(pool, _files_part, chunks, workers, zip_format):
+                    for cid, data in files:
+                        name = safe_name(cid)
+                        seen[name] = seen.get(name, 0) + 1
+                        if seen[name] > 1:
+                            name = f"{name}_{seen[name]}"
+                        zf.writestr(f"Complaint_{name}.{zip_format}", data)
+                    done += len(files)
+                    if on_progress:
+                        on_progress(done)
+        elif fmt == "docx":
+            entries, head, tail = documents.docx_skeleton()
+            with zipfile.ZipFile(tmp, "w", zipfile.ZIP_DEFLATED) as zf:
+                for info, data in entries:
+                    zf.writestr(info, data)
+                with zf.open("word/document.xml", "w") as body:
+                    body.write(head.encode("utf-8"))
+                    for xml, n in _ordered(pool, _docx_part, chunks, workers):
+                        if done:
+                            body.write(documents.DOCX_PAGE_BREAK.encode("utf-8"))
+                        body.write(xml.encode("utf-8"))
+                        done += n
+                        if on_progress:
+                            on_progress(done)
+                    body.write(tail.encode("utf-8"))
+        else:
+            part_dir = tempfile.mkdtemp(prefix="ebillx_export_", dir=os.path.dirname(os.path.abspath(out_path)))
+            try:
+                with open(tmp, "wb") as f:
+                    merged = PdfConcat(f)
+                    for part_path, n in _ordered(pool, _pdf_part, enumerate(chunks), workers, part_dir):
+                        merged.append(part_path)
+                        os.remove(part_path)
+                        done += n
+                        if on_progress:
+                            on_progress(done)
+                    merged.close()
+            finally:
+                shutil.rmtree(part_dir, ignore_errors=True)
+    os.replace(tmp, out_path)
+    return done
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Bulk complaint-letter export from batch results (JSONL)")
+    ap.add_argument("inputs", nargs="+", help="JSONL files written by batch.py")
+    ap.add_argument("-o", "--out", required=True)
+    ap.add_argument("-f", "--format", choices=FORMATS, default=None, help="default: from the output file extension")
+    ap.add_argument("--zip-format", choices=["pdf", "docx"], default="pdf", help="file type inside the ZIP")
+    ap.add_argument("-w", "--workers", type=int, default=None, help="render processes (default: CPU count)")
+    ap.add_argument("--chunk", type=int, default=CHUNK_SIZE, help="letters per work unit")
+    ap.add_argument("--officer", default="EXECUTIVE ENGINEER")
+    ap.add_argument("--lang", default="English", choices=["English", "हिंदी"])
+    ap.add_argument("--mobile", default="")
+    ap.add_argument("--date", default=date.today().isoformat())
+    ap.add_argument("--context", default="", help="extra context added to every letter")
+    ap.add_argument("--templates", action="store_true", help="use cached Gemini letter templates per complaint type")
+    args = ap.parse_args(argv)
+    fmt = args.format or os.path.splitext(args.out)[1].lstrip(".").lower()
+    if fmt not in FORMATS:
+        ap.error("cannot infer --format from the output file name")
+    letters = iter_letters(iter_records(args.inputs), args.officer, args.lang, args.mobile, args.date, args.context, args.templates)
+    start = time.time()
+    n = export_letters(letters, args.out, fmt, args.workers, args.chunk, args.zip_format,
+                       on_progress=lambda d: print(f"\r{d} letters", end="", file=sys.stderr))
+    elapsed = time.time() - start
+    print(f"\n{n} letters → {args.out} in {elapsed:.1f}s ({n / elapsed if elapsed else 0:.0f}/s)", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
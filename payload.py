@@ -0,0 +1,277 @@
+import re, json, time, threading
+import tracing
+from tariffs import parse_date, scan_number
+
+# Model output → Python: json.loads, else a C-level decode from each top-level opener, else a brace-balanced pass that closes
+# truncated output; then a schema compiled once per payload type coerces numbers, dates, booleans and "N/A".
+
+_ZERO_WIDTH = re.compile(r"[\u200b-\u200f\u202a-\u202e]")
+_TOKENS = re.compile(r'[{}\[\]"\\]')
+_DANGLING = re.compile(r'(?:,\s*"(?:[^"\\]|\\.)*"\s*:?\s*|[,:]\s*)$')
+MAX_RESTARTS = 8
+_decode = json.JSONDecoder().raw_decode
+MISSING = frozenset(["", "n/a", "na", "n.a.", "none", "null", "nil", "-", "--", "not available", "not found", "not applicable", "unknown"])
+TRUE = frozenset(["true", "yes", "y", "1", "correct", "sahi", "सही", "हाँ"])
+FALSE = frozenset(["false", "no", "n", "0", "incorrect", "wrong", "galat", "गलत", "नहीं"])
+
+_stats_lock = threading.Lock()
+_stats = {"calls": 0, "fast": 0, "scan": 0, "repaired": 0, "failed": 0, "coerced": 0, "coerce_problems": 0, "rejected": 0}
+
+def _count(**kw):
+    with _stats_lock:
+        for k, v in kw.items():
+            _stats[k] += v
+
+def parse_stats():
+    with _stats_lock:
+        s = dict(_stats)
+    # A payload that parsed but lacks required keys is as useless as one that did not parse
+    s["failure_rate"] = round((s["failed"] + s["rejected"]) / s["calls"], 4) if s["calls"] else 0.0
+    return s
+
+def parse_prometheus():
+    s = parse_stats()
+    lines = ["# HELP ebillx_json_parse_total Model responses by parse path", "# TYPE ebillx_json_parse_total counter"]
+    lines += [f'ebillx_json_parse_total{{path="{p}"}} {s[p]}' for p in ("fast", "scan", "repaired", "failed")]
+    lines += ["# HELP ebillx_schema_problems_total Fields the schema could not coerce cleanly", "# TYPE ebillx_schema_problems_total counter", f"ebillx_schema_problems_total {s['coerce_problems']}"]
+    lines += ["# HELP ebillx_schema_rejected_total Payloads rejected for missing required keys", "# TYPE ebillx_schema_rejected_total counter", f"ebillx_schema_rejected_total {s['rejected']}"]
+    return "\n".join(lines) + "\n"
+
+def _strip_fence(s):
+    if s.startswith("```"):
+        s = s[3:]
+        if s[:4].lower() == "json":
+            s = s[4:]
+        s = s.strip()
+        if s.endswith("```"):
+            s = s[:-3].rstrip()
+    return s
+
+def _scan(s):
+    # One pass over the structural characters only (string contents are skipped), decoding from each top-level
+    # opener as it is reached (objects first, like the old regex; arrays once the text is exhausted) and stopping at
+    # the first complete value, so trailing braces or a second object do not matter. Openers nested inside a
+    # truncated value are never tried, or its first complete child would pass for the answer. Returns (value, None)
+    # or (None, (start, stack, in_string)) for the last top-level span still open at the end, None if all balanced.
+    stack = []
+    start = None
+    tries = 0
+    arrays = []
+    in_str = False
+    escaped = -1
+    for m in _TOKENS.finditer(s):
+        i = m.start()
+        if i == escaped:
+            continue
+        c = s[i]
+        if in_str:
+            if c == "\\":
+                escaped = i + 1
+            elif c == '"':
+                in_str = False
+            continue
+        if c == '"':
+            in_str = bool(stack)
+        elif c == "{" or c == "[":
+            if not stack:
+                start = i
+                if c == "[":
+                    if len(arrays) < MAX_RESTARTS:
+                        arrays.append(i)
+                elif tries < MAX_RESTARTS:
+                    tries += 1
+                    try:
+                        return _decode(s, i)[0], None
+                    except ValueError:
+                        pass
+            stack.append(c)
+        elif stack and (c == "}") != (stack.pop() == "{"):
+            stack.clear()
+    for i in arrays:
+        try:
+            return _decode(s, i)[0], None
+        except ValueError:
+            continue
+    return None, ((start, stack, in_str) if stack else None)
+
+def _repair(s, state):
+    # Truncated output: close the open string, drop a dangling key/comma, then close every open bracket
+    start, stack, in_str = state
+    tail = s[start:].rstrip()
+    if in_str:
+        tail += '"'
+    tail = _DANGLING.sub("", tail)
+    tail += "".join("}" if c == "{" else "]" for c in reversed(stack))
+    try:
+        return json.loads(tail)
+    except ValueError:
+        return None
+
+def _extract(text):
+    if not text:
+        return None, "failed"
+    s = text.strip()
+    if _ZERO_WIDTH.search(s):
+        s = _ZERO_WIDTH.sub("", s)
+    s = _strip_fence(s)
+    if s[:1] in ("{", "["):
+        try:
+            return json.loads(s), "fast"
+        except ValueError:
+            pass
+    # Embedded in prose, followed by more text, or cut off
+    value, state = _scan(s)
+    if value is not None:
+        return value, "scan"
+    if state is not None:
+        value = _repair(s, state)
+        if value is not None:
+            return value, "repaired"
+    return None, "failed"
+
+def extract_json(text):
+    start = time.perf_counter()
+    value, path = _extract(text)
+    _count(calls=1, **{path: 1})
+    tracing.record("json.parse", time.perf_counter() - start, error="unparsable" if value is None else None, path=path)
+    return value
+
+def is_missing(v):
+    return v is None or (isinstance(v, str) and len(v) < 20 and v.strip().casefold() in MISSING)
+
+def parse_number(v):
+    # First numeric token of v (see tariffs.scan_number), keeping ints as ints
+    return scan_number(v)[0]
+
+def _text(missing):
+    def coerce(v, problems, key):
+        return missing if is_missing(v) else (v.strip() if isinstance(v, str) else str(v))
+    return coerce
+
+def _number(missing):
+    def coerce(v, problems, key):
+        if is_missing(v):
+            return missing
+        n, exact = scan_number(v)
+        if n is None:
+            problems.append(f"{key}: not a number ({str(v)[:40]})")
+            return missing
+        if not exact:
+            problems.append(f"{key}: ambiguous number ({str(v)[:40]}), using {n}")
+        return n
+    return coerce
+
+def _date(missing):
+    def coerce(v, problems, key):
+        if is_missing(v):
+            return missing
+        d = parse_date(v)
+        if d is None:
+            problems.append(f"{key}: unrecognised date ({str(v)[:40]})")
+            return v.strip() if isinstance(v, str) else str(v)
+        return d.isoformat()
+    return coerce
+
+def _bool(missing):
+    def coerce(v, problems, key):
+        if isinstance(v, bool):
+            return v
+        if is_missing(v):
+            return missing
+        s = str(v).strip().casefold()
+        if s in TRUE:
+            return True
+        if s in FALSE:
+            return False
+        problems.append(f"{key}: not a boolean ({str(v)[:40]})")
+        return missing
+    return coerce
+
+_SCALARS = {"text": _text, "number": _number, "date": _date, "bool": _bool}
+
+def compile_schema(spec, missing=None, required=()):
+    # spec: {key: "text"|"number"|"date"|"bool"|{nested spec}|[item spec]}, turned into a flat tuple of closures
+    # once. Keys outside the spec pass through, absent keys stay absent, missing-looking values become `missing`.
+    # required: dotted paths ("calculation.total") that must be present; an absent one is reported as REQUIRED.
+    fields = []
+    here = tuple(k for k in required if "." not in k)
+    for key, t in spec.items():
+        if isinstance(t, dict):
+            below = tuple(k[len(key) + 1:] for k in required if k.startswith(key + "."))
+            fields.append((key, _object(compile_schema(t, missing, below))))
+        elif isinstance(t, list):
+            nested = isinstance(t[0], dict)
+            fields.append((key, _array(compile_schema(t[0], missing) if nested else _SCALARS[t[0]](missing), nested)))
+        else:
+            fields.append((key, _SCALARS[t](missing)))
+    fields = tuple(fields)
+
+    def coerce(payload, problems, path=""):
+        for key in here:
+            if key not in payload:
+                problems.append(f"{path}{key}: {REQUIRED}")
+        out = dict(payload)
+        for key, fn in fields:
+            if key in payload:
+                out[key] = fn(payload[key], problems, path + key)
+        return out
+    return coerce
+
+REQUIRED = "required key missing"
+
+def _object(inner):
+    def coerce(v, problems, key):
+        if not isinstance(v, dict):
+            if not is_missing(v):
+                problems.append(f"{key}: expected an object")
+            return inner({}, problems, key + ".")  # empty, but still reports the required keys it lacks
+        return inner(v, problems, key + ".")
+    return coerce
+
+def _array(inner, objects):
+    def coerce(v, problems, key):
+        if not isinstance(v, list):
+            if not is_missing(v):
+                problems.append(f"{key}: expected a list")
+            return []
+        if objects:
+            return [inner(x, problems, f"{key}[{i}].") if isinstance(x, dict) else x for i, x in enumerate(v)]
+        return [inner(x, problems, f"{key}[{i}]") for i, x in enumerate(v)]
+    return coerce
+
+BILL_SCHEMA = {
+    "Consumer_ID": "text", "Consumer_Name": "text", "Sanctioned_Load_kW": "number", "Units_Consumed_kWh": "number",
+    "Billing_Date": "date", "Total_Amount_Payable_INR": "number", "Discom_Name": "text", "Division": "text",
+    "Tariff_Category": "text", "Reading_Type": "text", "Raw_Bill_Text": "text",
+}
+CALCULATION_SCHEMA = {
+    "fixed_per_kw": "number", "duty": "number", "difference": "number", "bill_correct": "bool",
+    "slabs": [{"rate": "number"}],
+    "calculation": {"fixed": "number", "energy_details": [{"units": "number", "rate": "number", "amount": "number"}],
+                    "energy_total": "number", "duty": "number", "total": "number"},
+}
+# Keys the checks cannot do without; a value of "N/A" still counts as present
+BILL_REQUIRED = ("Consumer_ID", "Sanctioned_Load_kW", "Units_Consumed_kWh", "Total_Amount_Payable_INR")
+CALCULATION_REQUIRED = ("calculation", "calculation.total")
+_coerce_bill = compile_schema(BILL_SCHEMA, missing="N/A", required=BILL_REQUIRED)
+_coerce_calculation = compile_schema(CALCULATION_SCHEMA, missing=None, required=CALCULATION_REQUIRED)
+
+def _validate(stage, coerce, payload):
+    if not isinstance(payload, dict):
+        return None, [f"expected a JSON object, got {type(payload).__name__}"]
+    start = time.perf_counter()
+    problems = []
+    out = coerce(payload, problems)
+    # Wrong-shaped payload (a nested fragment, a truncated tail): reject it rather than pass on a half-empty result
+    rejected = any(p.endswith(REQUIRED) for p in problems)
+    _count(coerced=1, coerce_problems=len(problems), rejected=int(rejected))
+    tracing.record(stage, time.perf_counter() - start, error="; ".join(problems)[:200] if problems else None)
+    return (None if rejected else out), problems
+
+def coerce_bill(payload):
+    # Returns (bill, problems): numbers as int/float, Billing_Date as ISO when recognised, missing values as "N/A"
+    return _validate("schema.bill", _coerce_bill, payload)
+
+def coerce_calculation(payload):
+    # Returns (calculation, problems): numbers as int/float, missing values as None
+    return _validate("schema.calculation", _coerce_calculation, payload)
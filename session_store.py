@@ -0,0 +1,271 @@
+import os, sys, json, time, hashlib, logging, threading
+from dataclasses import dataclass
+from extract_cache import CACHE_DIR
+
+log = logging.getLogger("ebillx.session")
+
+BLOB_DIR = os.path.join(CACHE_DIR, "blobs")
+INLINE_LIMIT = 512
+SESSION_BUDGET_BYTES = int(float(os.environ.get("EBILLX_SESSION_BUDGET_KB", 256)) * 1024)
+PARTIAL_SUFFIXES = (".tmp", ".part")
+
+class MissingBlobError(LookupError):
+    pass
+
+class BlobStore:
+    # Disk-backed store for large values (raw bill text, rendered documents, batch results) referenced by handle.
+    # Handles are content hashes unless a key is given; past max_bytes the oldest finished blobs are pruned, except
+    # those pinned by a live session or touched within grace_s.
+    def __init__(self, path=BLOB_DIR, max_bytes=None, grace_s=None):
+        self.path = path
+        self.max_bytes = int(float(os.environ.get("EBILLX_BLOB_MAX_MB", 512)) * 1024 * 1024) if max_bytes is None else max_bytes
+        self.grace_s = float(os.environ.get("EBILLX_BLOB_GRACE_S", 3600)) if grace_s is None else grace_s
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._size = None
+        self._pins = {}
+
+    def path_for(self, handle):
+        return os.path.join(self.path, handle)
+
+    def put(self, data, key=None):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        handle = key or hashlib.sha256(data).hexdigest()
+        p = self.path_for(handle)
+        if os.path.exists(p):
+            os.utime(p)
+            return handle
+        tmp = f"{p}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, p)
+        self._added(len(data))
+        return handle
+
+    def put_file(self, src, handle):
+        # Moves a file written elsewhere (e.g. a bulk export) into the store without reading it into memory
+        os.replace(src, self.path_for(handle))
+        self._added(os.path.getsize(self.path_for(handle)))
+        return handle
+
+    def _added(self, nbytes):
+        with self._lock:
+            if self._size is None:
+                self._size = sum(e.stat().st_size for e in os.scandir(self.path) if e.is_file())
+            else:
+                self._size += nbytes
+            if self._size > self.max_bytes:
+                self._prune()
+
+    def exists(self, handle):
+        return os.path.isfile(self.path_for(handle))
+
+    def pin(self, owner, handles):
+        with self._lock:
+            if handles:
+                self._pins[owner] = frozenset(handles)
+            else:
+                self._pins.pop(owner, None)
+
+    def unpin(self, owner):
+        with self._lock:
+            self._pins.pop(owner, None)
+
+    def get(self, handle):
+        try:
+            with open(self.path_for(handle), "rb") as f:
+                return f.read()
+        except (OSError, ValueError):
+            return None
+
+    def get_text(self, handle):
+        data = self.get(handle)
+        return data.decode("utf-8") if data is not None else None
+
+    def _prune(self):
+        # In-progress files (.tmp/.part), pinned handles and anything younger than grace_s are never removed
+        pinned = frozenset().union(*self._pins.values())
+        cutoff = time.time() - self.grace_s
+        entries = sorted((e for e in os.scandir(self.path) if e.is_file() and not e.name.endswith(PARTIAL_SUFFIXES)
+                          and e.name not in pinned and e.stat().st_mtime < cutoff), key=lambda e: e.stat().st_mtime)
+        target = int(self.max_bytes * 0.9)
+        for e in entries:
+            if self._size <= target:
+                break
+            try:
+                size = e.stat().st_size
+                os.remove(e.path)
+                self._size -= size
+            except OSError:
+                pass
+
+    def stats(self):
+        files = [e for e in os.scandir(self.path) if e.is_file()]
+        return {"blobs": len(files), "mb": round(sum(e.stat().st_size for e in files) / 2**20, 2)}
+
+def stash(value, blobs):
+    # Long strings are kept on disk and replaced by a "blob:<handle>" reference
+    if blobs is not None and isinstance(value, str) and len(value) > INLINE_LIMIT:
+        return "blob:" + blobs.put(value)
+    return value
+
+def unstash(value, blobs):
+    if blobs is not None and isinstance(value, str) and value.startswith("blob:"):
+        text = blobs.get_text(value[5:])
+        if text is None:
+            raise MissingBlobError(value[5:])
+        return text
+    return value
+
+def blob_refs(obj, out):
+    # Collects the handles of every "blob:<handle>" string reachable from obj
+    if isinstance(obj, str):
+        if obj.startswith("blob:"):
+            out.add(obj[5:])
+    elif isinstance(obj, dict):
+        for v in obj.values():
+            blob_refs(v, out)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for v in obj:
+            blob_refs(v, out)
+    elif hasattr(obj, "__slots__"):
+        for s in obj.__slots__:
+            blob_refs(getattr(obj, s, None), out)
+    return out
+
+@dataclass(slots=True)
+class Mistake:
+    code: str
+    description: str
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(str(d.get("Mistake_Code") or ""), str(d.get("Description_Hindi") or d.get("description") or ""))
+
+    def to_dict(self):
+        return {"Mistake_Code": self.code, "Description_Hindi": self.description}
+
+BILL_KEYS = ("Consumer_ID", "Consumer_Name", "Sanctioned_Load_kW", "Units_Consumed_kWh", "Billing_Date",
+             "Total_Amount_Payable_INR", "Discom_Name", "Division", "Tariff_Category", "Reading_Type")
+
+@dataclass(slots=True)
+class Bill:
+    consumer_id: object = None
+    consumer_name: object = None
+    sanctioned_load_kw: object = None
+    units_consumed_kwh: object = None
+    billing_date: object = None
+    total_amount_payable_inr: object = None
+    discom_name: object = None
+    division: object = None
+    tariff_category: object = None
+    reading_type: object = None
+    raw_text: object = None
+    extra: tuple = ()
+
+    @classmethod
+    def from_dict(cls, d, blobs=None):
+        extra = tuple((k, stash(v, blobs)) for k, v in d.items() if k not in BILL_KEYS and k != "Raw_Bill_Text")
+        return cls(*(d.get(k) for k in BILL_KEYS), stash(d.get("Raw_Bill_Text"), blobs), extra)
+
+    def to_dict(self, blobs=None, raw=True):
+        d = {k: getattr(self, k.lower()) for k in BILL_KEYS}
+        if raw and self.raw_text is not None:
+            d["Raw_Bill_Text"] = unstash(self.raw_text, blobs)
+        d.update((k, unstash(v, blobs)) for k, v in self.extra)
+        return d
+
+    def get(self, key, default=None):
+        v = getattr(self, key.lower(), None) if key in BILL_KEYS else dict(self.extra).get(key)
+        return default if v is None else v
+
+@dataclass(slots=True)
+class EnergyRow:
+    slab: object
+    units: object
+    rate: object
+    amount: object
+
+@dataclass(slots=True)
+class Calculation:
+    fixed: object = 0
+    energy_total: object = 0
+    duty: object = 0
+    total: object = 0
+    energy: tuple = ()
+    rest: object = None
+
+    @classmethod
+    def from_dict(cls, d, blobs=None):
+        c = d.get("calculation") or {}
+        energy = tuple(EnergyRow(e.get("slab") or e.get("range") or "", e.get("units") or e.get("units_billed") or 0,
+                                 e.get("rate") or 0, e.get("amount") or 0) for e in c.get("energy_details") or [])
+        rest = {k: v for k, v in d.items() if k != "calculation"}
+        return cls(c.get("fixed", 0), c.get("energy_total", 0), c.get("duty", 0), c.get("total", 0), energy,
+                   stash(json.dumps(rest, ensure_ascii=False, separators=(",", ":"), default=str), blobs) if rest else None)
+
+    def to_dict(self, blobs=None):
+        rest = unstash(self.rest, blobs)
+        d = json.loads(rest) if rest else {}
+        d["calculation"] = {"fixed": self.fixed, "energy_details": [{"slab": e.slab, "units": e.units, "rate": e.rate, "amount": e.amount}
+                                                                    for e in self.energy],
+                            "energy_total": self.energy_total, "duty": self.duty, "total": self.total}
+        return d
+
+def deep_size(obj, seen=None):
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_size(v, seen) for v in obj)
+    elif hasattr(obj, "__slots__"):
+        size += sum(deep_size(getattr(obj, s, None), seen) for s in obj.__slots__)
+    elif hasattr(obj, "__dict__"):
+        size += deep_size(vars(obj), seen)
+    return size
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def account(session_id, state, blobs=None):
+    # Called once per rerun; keeps the latest footprint of each session for the admin panel and pins the blobs
+    # its state still references so pruning cannot pull them out from under it
+    sizes = {}
+    refs = set()
+    for k in list(state.keys()):
+        try:
+            sizes[k] = deep_size(state[k])
+            blob_refs(state[k], refs)
+        except Exception:
+            continue
+    if blobs is not None:
+        blobs.pin(session_id, refs)
+    total = sum(sizes.values())
+    with _sessions_lock:
+        _sessions[session_id] = (total, time.time(), max(sizes, key=sizes.get) if sizes else None)
+    if total > SESSION_BUDGET_BYTES:
+        log.warning("session %s holds %d KB of state (largest key: %s)", session_id, total // 1024, _sessions[session_id][2])
+    return total
+
+def forget_idle(max_idle_s=3600, blobs=None):
+    cutoff = time.time() - max_idle_s
+    with _sessions_lock:
+        idle = [s for s, v in _sessions.items() if v[1] < cutoff]
+        for sid in idle:
+            del _sessions[sid]
+    if blobs is not None:
+        for sid in idle:
+            blobs.unpin(sid)
+
+def memory_stats():
+    with _sessions_lock:
+        items = list(_sessions.items())
+    sizes = sorted((v[0] for _, v in items), reverse=True)
+    return {"sessions": len(items), "total_kb": round(sum(sizes) / 1024, 1), "max_kb": round(sizes[0] / 1024, 1) if sizes else 0,
+            "mean_kb": round(sum(sizes) / len(sizes) / 1024, 1) if sizes else 0,
+            "over_budget": sum(1 for s in sizes if s > SESSION_BUDGET_BYTES)}
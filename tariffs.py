@@ -0,0 +1,156 @@
+import os, re, json, bisect
+from datetime import date, datetime
+
+TARIFF_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tariffs.json")
+
+DATE_FORMATS = ["%d-%m-%Y", "%d/%m/%Y", "%d.%m.%Y", "%Y-%m-%d", "%Y/%m/%d", "%d-%m-%y", "%d/%m/%y",
+                "%d-%b-%Y", "%d %b %Y", "%d-%B-%Y", "%d %B %Y", "%b-%Y", "%b %Y", "%B %Y", "%m/%Y", "%m-%Y"]
+
+def norm_key(v):
+    return re.sub(r"[^0-9a-z]+", "", str(v or "").casefold())
+
+# One numeric token: sign, leading-decimal (".5") and exponent forms; "1,400" loses its thousands separators first.
+# A leading "." right after a letter is an abbreviation ("Rs.1,400", "INR.250"), not a decimal point.
+NUMBER_RE = re.compile(r"[-+]?(?:\d+(?:\.\d*)?|(?<![^\W\d_])\.\d+)(?:[eE][-+]?\d+)?")
+_THOUSANDS = re.compile(r"(?<=\d),(?=\d)")
+# What may surround a number on a bill without making it ambiguous ("Rs. 1,400/-", "2 kW", "5%")
+_NUMBER_DECOR = re.compile(r"(?i)\b(?:rs|inr|kwh|kw|kva|units?)\b\.?|[₹$%/=:()\s-]")
+
+def scan_number(v):
+    # Returns (first numeric token or None, exact). exact is False when the string holds several numbers
+    # ("12-03-2024", "5 kW (3 phase)") or other text beside the number, so callers can flag the value.
+    if isinstance(v, bool) or v is None:
+        return None, False
+    if isinstance(v, (int, float)):
+        return v, True
+    s = _THOUSANDS.sub("", str(v))
+    tokens = NUMBER_RE.findall(s)
+    if not tokens:
+        return None, False
+    t = tokens[0]
+    n = float(t)
+    if n.is_integer() and not any(c in t for c in ".eE"):
+        n = int(n)
+    return n, len(tokens) == 1 and not _NUMBER_DECOR.sub("", s.replace(t, "", 1))
+
+def to_number(v):
+    n, _ = scan_number(v)
+    return float(n) if n is not None else None
+
+def parse_date(v):
+    if isinstance(v, datetime):
+        return v.date()
+    if isinstance(v, date):
+        return v
+    s = str(v or "").strip()
+    if not s or s.upper() == "N/A":
+        return None
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(s, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+class TariffStore:
+    def __init__(self, tariffs=None, version=None):
+        self.version = version
+        self._index = {}
+        for t in tariffs or []:
+            self.add(t)
+
+    @classmethod
+    def load(cls, path=TARIFF_FILE):
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return cls()
+        return cls(data.get("tariffs", []), data.get("version"))
+
+    def add(self, tariff):
+        eff = parse_date(tariff.get("effective_from")) or date.min
+        discoms = [tariff.get("discom")] + list(tariff.get("discom_aliases", []))
+        categories = [tariff.get("tariff_category")] + list(tariff.get("category_aliases", []))
+        for d in discoms:
+            for c in categories:
+                dates, entries = self._index.setdefault((norm_key(d), norm_key(c)), ([], []))
+                pos = bisect.bisect_right(dates, eff)
+                dates.insert(pos, eff)
+                entries.insert(pos, tariff)
+
+    def lookup(self, discom, category, on_date=None):
+        bucket = self._index.get((norm_key(discom), norm_key(category)))
+        if not bucket:
+            return None
+        dates, entries = bucket
+        pos = bisect.bisect_right(dates, on_date or date.today())
+        return entries[pos - 1] if pos else None
+
+    def __len__(self):
+        return len({id(t) for _, entries in self._index.values() for t in entries})
+
+def slab_label(lower, upto):
+    return f"{int(lower)}+" if upto is None else f"{int(lower) + (1 if lower else 0)}-{int(upto)}"
+
+def slab_breakdown(units, slabs):
+    details = []
+    lower = 0.0
+    remaining = units
+    for s in slabs:
+        upto = to_number(s.get("upto"))
+        rate = to_number(s.get("rate")) or 0.0
+        width = remaining if upto is None else max(0.0, min(remaining, upto - lower))
+        if width > 0:
+            details.append({"slab": slab_label(lower, upto), "units": round(width, 2), "rate": rate, "amount": round(width * rate, 2)})
+        remaining -= width
+        if upto is not None:
+            lower = upto
+        if remaining <= 0:
+            break
+    return details
+
+def calculate_bill(bill, tariff):
+    units = to_number(bill.get("Units_Consumed_kWh"))
+    if units is None:
+        return None
+    load = to_number(bill.get("Sanctioned_Load_kW"))
+    fixed_per_kw = to_number(tariff.get("fixed_per_kw")) or 0.0
+    fixed = fixed_per_kw * (load if load else 1.0)
+    fixed = round(max(fixed, to_number(tariff.get("min_fixed")) or 0.0), 2)
+    slabs = tariff.get("slabs", [])
+    energy_details = slab_breakdown(units, slabs)
+    energy_total = round(sum(e["amount"] for e in energy_details), 2)
+    duty_pct = to_number(tariff.get("duty_percent")) or 0.0
+    duty = round((fixed + energy_total) * duty_pct / 100.0, 2)
+    total = round(fixed + energy_total + duty, 2)
+    provided = to_number(bill.get("Total_Amount_Payable_INR"))
+    difference = round(provided - total, 2) if provided is not None else None
+    ranges = []
+    lower = 0.0
+    for s in slabs:
+        upto = to_number(s.get("upto"))
+        ranges.append({"range": slab_label(lower, upto), "rate": to_number(s.get("rate"))})
+        if upto is not None:
+            lower = upto
+    return {
+        "discom": tariff.get("discom"),
+        "division": bill.get("Division", "N/A"),
+        "tariff_category": tariff.get("tariff_category"),
+        "fixed_per_kw": fixed_per_kw,
+        "slabs": ranges,
+        "duty": duty_pct,
+        "calculation": {"fixed": fixed, "energy_details": energy_details, "energy_total": energy_total, "duty": duty, "total": total},
+        "bill_correct": (abs(difference) <= 0.03 * provided) if difference is not None and provided else None,
+        "difference": difference,
+        "source": "local",
+        "tariff_id": tariff.get("id"),
+    }
+
+def calculate_locally(bill, store):
+    if store is None or not bill:
+        return None
+    tariff = store.lookup(bill.get("Discom_Name"), bill.get("Tariff_Category"), parse_date(bill.get("Billing_Date")))
+    if tariff is None:
+        return None
+    return calculate_bill(bill, tariff)
@@ -0,0 +1,165 @@
+import os, json, time, atexit, threading, functools
+from collections import deque, defaultdict
+from contextlib import contextmanager
+
+TRACE_FILE = os.environ.get("EBILLX_TRACE_FILE", os.path.join(os.environ.get("EBILLX_CACHE_DIR", ".ebillx_cache"), "trace.jsonl"))
+TRACE_ENABLED = os.environ.get("EBILLX_TRACE", "1").strip().lower() not in ("0", "false", "no", "off")
+WINDOW = int(os.environ.get("EBILLX_TRACE_WINDOW", 2000))
+TRACE_MAX_BYTES = int(float(os.environ.get("EBILLX_TRACE_MAX_MB", 20)) * 1024 * 1024)
+TRACE_KEEP = int(os.environ.get("EBILLX_TRACE_KEEP", 3))
+FLUSH_EVERY = 50
+FLUSH_SECONDS = 5.0
+
+_lock = threading.Lock()
+_file_lock = threading.Lock()
+_durations = defaultdict(lambda: deque(maxlen=WINDOW))
+_counts = defaultdict(int)
+_errors = defaultdict(int)
+_sums = defaultdict(float)
+_tokens = defaultdict(lambda: {"prompt": 0, "output": 0, "total": 0, "calls": 0})
+_pending = []
+_last_flush = time.time()
+
+def record(stage, duration_s, error=None, **attrs):
+    if not TRACE_ENABLED:
+        return
+    with _lock:
+        _durations[stage].append(duration_s)
+        _counts[stage] += 1
+        _sums[stage] += duration_s
+        if error:
+            _errors[stage] += 1
+        rec = {"ts": round(time.time(), 3), "stage": stage, "ms": round(duration_s * 1000, 2)}
+        if error:
+            rec["error"] = str(error)[:200]
+        if attrs:
+            rec.update(attrs)
+        _pending.append(rec)
+        due = len(_pending) >= FLUSH_EVERY or time.time() - _last_flush > FLUSH_SECONDS
+    if due:
+        flush()
+
+def record_tokens(stage, resp):
+    usage = getattr(resp, "usage_metadata", None)
+    if usage is None or not TRACE_ENABLED:
+        return
+    with _lock:
+        t = _tokens[stage]
+        t["prompt"] += getattr(usage, "prompt_token_count", 0) or 0
+        t["output"] += getattr(usage, "candidates_token_count", 0) or 0
+        t["total"] += getattr(usage, "total_token_count", 0) or 0
+        t["calls"] += 1
+
+@contextmanager
+def span(stage, **attrs):
+    start = time.perf_counter()
+    err = None
+    try:
+        yield attrs
+    except Exception as e:
+        err = e
+        raise
+    finally:
+        record(stage, time.perf_counter() - start, err, **attrs)
+
+def traced(stage, returns_error=False):
+    # returns_error: the function reports failures as the last item of a returned tuple instead of raising
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                res = fn(*args, **kwargs)
+            except Exception as e:
+                record(stage, time.perf_counter() - start, e)
+                raise
+            err = res[-1] if returns_error and isinstance(res, tuple) and res else None
+            record(stage, time.perf_counter() - start, err)
+            return res
+        return wrapper
+    return deco
+
+def flush():
+    global _last_flush
+    with _lock:
+        batch = _pending[:]
+        _pending.clear()
+        _last_flush = time.time()
+    if not batch or not TRACE_FILE:
+        return
+    try:
+        d = os.path.dirname(TRACE_FILE)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        with _file_lock:
+            _rotate()
+            with open(TRACE_FILE, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in batch))
+    except OSError:
+        pass
+
+def _rotate():
+    # trace.jsonl → trace.jsonl.1 → … → trace.jsonl.<TRACE_KEEP> once it passes TRACE_MAX_BYTES; the oldest is dropped
+    if not TRACE_MAX_BYTES or not os.path.exists(TRACE_FILE) or os.path.getsize(TRACE_FILE) < TRACE_MAX_BYTES:
+        return
+    if TRACE_KEEP < 1:
+        os.remove(TRACE_FILE)
+        return
+    for i in range(TRACE_KEEP, 0, -1):
+        src = TRACE_FILE if i == 1 else f"{TRACE_FILE}.{i - 1}"
+        if os.path.exists(src):
+            os.replace(src, f"{TRACE_FILE}.{i}")
+
+atexit.register(flush)
+
+def percentile(sorted_vals, q):
+    if not sorted_vals:
+        return None
+    k = (len(sorted_vals) - 1) * q
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_vals) - 1)
+    return sorted_vals[lo] + (sorted_vals[hi] - sorted_vals[lo]) * (k - lo)
+
+def summary():
+    with _lock:
+        stages = {k: sorted(v) for k, v in _durations.items()}
+        counts = dict(_counts)
+        errors = dict(_errors)
+        sums = dict(_sums)
+    out = {}
+    for stage, vals in sorted(stages.items()):
+        out[stage] = {"count": counts.get(stage, 0), "errors": errors.get(stage, 0), "sum_s": round(sums.get(stage, 0.0), 4),
+                      "p50_ms": round(percentile(vals, 0.5) * 1000, 2), "p95_ms": round(percentile(vals, 0.95) * 1000, 2),
+                      "max_ms": round(vals[-1] * 1000, 2)}
+    return out
+
+def token_usage():
+    with _lock:
+        return {k: dict(v) for k, v in _tokens.items()}
+
+def prometheus_text():
+    stages = summary()
+    lines = ["# HELP ebillx_stage_seconds Stage latency (quantiles over the recent window, count and sum since start)",
+             "# TYPE ebillx_stage_seconds summary"]
+    for stage, s in stages.items():
+        lines.append(f'ebillx_stage_seconds{{stage="{stage}",quantile="0.5"}} {s["p50_ms"] / 1000}')
+        lines.append(f'ebillx_stage_seconds{{stage="{stage}",quantile="0.95"}} {s["p95_ms"] / 1000}')
+        lines.append(f'ebillx_stage_seconds_sum{{stage="{stage}"}} {s["sum_s"]}')
+        lines.append(f'ebillx_stage_seconds_count{{stage="{stage}"}} {s["count"]}')
+    lines += ["# HELP ebillx_stage_errors_total Stage calls that failed", "# TYPE ebillx_stage_errors_total counter"]
+    lines += [f'ebillx_stage_errors_total{{stage="{stage}"}} {s["errors"]}' for stage, s in stages.items()]
+    usage = token_usage()
+    if usage:
+        lines += ["# HELP ebillx_gemini_tokens_total Gemini tokens used", "# TYPE ebillx_gemini_tokens_total counter"]
+        for stage, t in usage.items():
+            for kind in ("prompt", "output", "total"):
+                lines.append(f'ebillx_gemini_tokens_total{{stage="{stage}",kind="{kind}"}} {t[kind]}')
+    return "\n".join(lines) + "\n"
+
+def export_prometheus(path=None):
+    path = path or os.path.splitext(TRACE_FILE)[0] + ".prom"
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(prometheus_text())
+    os.replace(tmp, path)
+    return path